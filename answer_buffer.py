@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from debounce import Debounce
+from scoring import ANSWERS_PER_ROUND
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingAnswers:
+    room_code: Optional[str] = None
+    answers: List[str] = field(default_factory=list)
+    updated: float = 0.0
+    dirty: bool = False
+    message_id: Optional[int] = None  # статус «Принято N/6» текущего раунда
+    text: Optional[str] = None
+    debounce: Optional[Debounce] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class AnswerCoalescer:
+    # Сообщения игрока, пришедшие с паузой меньше window секунд, склеиваются в один набор ответов,
+    # более позднее сообщение заменяет набор целиком. В room_state уходит только итоговая версия —
+    # через window секунд тишины, а статус «Принято N/6» редактируется в одном и том же сообщении.
+    # render(answers) -> (text, kwargs) для статуса; on_rejected(user_id) — раунд уже закрыт.
+    # Буфер живёт в памяти одного воркера: с window=0 (для ROOM_STATE_BACKEND=database) ответы
+    # пишутся сразу и ничего не копится, иначе закрывающий раунд воркер не увидел бы чужих ответов.
+    def __init__(self, room_state, broadcaster, render, on_rejected, window=1.5):
+        self.room_state = room_state
+        self.broadcaster = broadcaster
+        self.render = render
+        self.on_rejected = on_rejected
+        self.window = window
+        self.entries = {}
+        self.rooms = defaultdict(set)  # room_code -> user_id с записями
+
+    async def submit(self, user_id, answers, room_code=None):
+        if self.window <= 0:
+            entry = PendingAnswers(room_code, answers[:ANSWERS_PER_ROUND], dirty=True)
+            await self._flush_entry(user_id, entry)
+            return len(entry.answers)
+        entry = self.entries.get(user_id)
+        if entry is not None and entry.room_code != room_code:
+            # Игрок перешёл в другую комнату — запись старой уже не нужна
+            self._evict(user_id, entry)
+            entry = None
+        if entry is None:
+            entry = self.entries[user_id] = PendingAnswers(room_code)
+            self.rooms[room_code].add(user_id)
+        now = time.monotonic()
+        # Дописывание склеивается, только пока вместе выходит не больше шести ответов. Полный набор
+        # или переполнение — это исправление, и новое сообщение заменяет набор целиком
+        if (entry.dirty and now - entry.updated <= self.window
+                and len(entry.answers) + len(answers) <= ANSWERS_PER_ROUND):
+            entry.answers = entry.answers + answers
+        else:
+            entry.answers = answers[:ANSWERS_PER_ROUND]
+        entry.updated = now
+        entry.dirty = True
+        if entry.debounce is None:
+            entry.debounce = Debounce(lambda: self._flush_entry(user_id, entry), lambda: entry.dirty,
+                                      f"ответы игрока {user_id}", "answer_flush")
+        entry.debounce.schedule(now + self.window)
+        return len(entry.answers)
+
+    async def _flush_entry(self, user_id, entry):
+        async with entry.lock:
+            if not entry.dirty:
+                return True
+            entry.dirty = False
+            answers = list(entry.answers)
+
+            if not await self.room_state.submit_answers(user_id, answers):
+                self._evict(user_id, entry)
+                await self.on_rejected(user_id)
+                return False
+
+            text, kwargs = self.render(answers)
+            if entry.message_id is not None and text == entry.text:
+                return True
+            if entry.message_id is not None:
+                delivery = await self.broadcaster.edit(user_id, entry.message_id, text, **kwargs)
+                if not delivery.ok:
+                    entry.message_id = None
+            if entry.message_id is None:
+                delivery = await self.broadcaster.send(user_id, text, **kwargs)
+                if delivery.ok:
+                    entry.message_id = delivery.message.message_id
+            entry.text = text
+            return True
+
+    async def flush(self, user_id):
+        entry = self.entries.get(user_id)
+        return await self._flush_entry(user_id, entry) if entry else True
+
+    async def _flush_many(self, user_ids, label):
+        # Ошибка одного игрока не должна сорвать подсчёт итогов для остальных
+        entries = [(user_id, self.entries[user_id]) for user_id in user_ids if user_id in self.entries]
+        results = await asyncio.gather(*(self._flush_entry(user_id, entry) for user_id, entry in entries),
+                                       return_exceptions=True)
+        for (user_id, entry), result in zip(entries, results):
+            if isinstance(result, Exception):
+                logger.error("Не удалось сохранить ответы игрока %s (%s)", user_id, label, exc_info=result)
+            self._evict(user_id, entry)
+
+    async def flush_room(self, room_code):
+        # Раунд закрыт: ответы комнаты записываются, а её записи больше не нужны.
+        # Записи без известной комнаты пишутся заодно — раньше срока, но не теряются
+        user_ids = set(self.rooms.get(room_code, ())) | set(self.rooms.get(None, ()))
+        await self._flush_many(user_ids, f"комната {room_code}")
+
+    async def flush_all(self):
+        await self._flush_many(list(self.entries), "остановка бота")
+
+    def drop_room(self, room_code):
+        for user_id in list(self.rooms.get(room_code, ())):
+            self._evict(user_id, self.entries.get(user_id))
+
+    def reset(self, user_ids):
+        # Новый раунд — новое статусное сообщение
+        for user_id in user_ids:
+            self._evict(user_id, self.entries.get(user_id))
+
+    def _evict(self, user_id, entry):
+        if entry is None or self.entries.get(user_id) is not entry:
+            return
+        del self.entries[user_id]
+        if entry.debounce is not None:
+            entry.debounce.cancel()
+        room = self.rooms.get(entry.room_code)
+        if room is not None:
+            room.discard(user_id)
+            if not room:
+                del self.rooms[entry.room_code]
@@ -0,0 +1,59 @@
+from collections import Counter, defaultdict
+
+from sqlalchemy import delete, func, insert, select, tuple_
+
+from database import RoundAnswer
+from matching import STEMMED, normalize, stem
+
+# С какого размера комнаты индекс совпадений дешевле посчитать в БД одним GROUP BY
+SQL_INDEX_MIN_PLAYERS = 30
+
+
+def answer_rows(player_id, room_code, round_number, answers):
+    return [
+        {"player_id": player_id, "room_code": room_code, "round_number": round_number,
+         "position": position, "raw": answer, "normalized": normalize(answer), "stemmed": stem(normalize(answer))}
+        for position, answer in enumerate(answers)
+    ]
+
+
+async def replace_answers(session, submissions):
+    # submissions: [(player_id, room_code, round_number, [answer, ...]), ...]
+    if not submissions:
+        return
+    keys = [(player_id, round_number) for player_id, _, round_number, _ in submissions]
+    await session.execute(delete(RoundAnswer).where(tuple_(RoundAnswer.player_id, RoundAnswer.round_number).in_(keys)))
+
+    rows = [row for submission in submissions for row in answer_rows(*submission)]
+    if rows:
+        await session.execute(insert(RoundAnswer), rows)
+
+
+async def load_answers(session, room_code, round_number, raw=False):
+    column = RoundAnswer.raw if raw else RoundAnswer.normalized
+    rows = await session.execute(
+        select(RoundAnswer.player_id, column).where(
+            RoundAnswer.room_code == room_code, RoundAnswer.round_number == round_number).order_by(
+            RoundAnswer.player_id, RoundAnswer.position))
+
+    answers = defaultdict(list)
+    for player_id, answer in rows:
+        answers[player_id].append(answer)
+    return answers
+
+
+async def load_index(session, room_code, round_number, r_type, level):
+    # То же, что scoring.build_index, но одним запросом по индексу (room_code, round_number, position, форма):
+    # форма — normalized или stemmed, в зависимости от строгости раунда
+    column = RoundAnswer.stemmed if level == STEMMED else RoundAnswer.normalized
+    keys = [RoundAnswer.position, column] if r_type == "express" else [column]
+    rows = await session.execute(
+        select(*keys, func.count(func.distinct(RoundAnswer.player_id))).where(
+            RoundAnswer.room_code == room_code, RoundAnswer.round_number == round_number,
+            column != None).group_by(*keys))
+
+    index = Counter()
+    for row in rows:
+        key = (row[0], row[1]) if r_type == "express" else row[0]
+        index[key] = row[-1]
+    return index
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "SmySLov", "username": "smyslov_bot"}
+
+
+class FakeTelegram:
+    # Локальная замена Bot API: подтверждает вызовы бота и складывает исходящие сообщения по чатам
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.messages = defaultdict(list)
+        self.events = defaultdict(asyncio.Event)
+        self.message_ids = defaultdict(int)
+        self.runner = None
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self, host="127.0.0.1", port=8081):
+        self.runner = web.AppRunner(self.create_app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if len(params.get("text", "")) > 4096:
+            # Как настоящий Bot API: слишком длинное сообщение не отправляется
+            return web.json_response({"ok": False, "error_code": 400, "description": "Bad Request: message is too long"})
+        handler = getattr(self, f"on_{method.lower()}", None)
+        result = handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    def _record(self, chat_id, params, message_id=None):
+        if message_id is None:
+            self.message_ids[chat_id] += 1
+            message_id = self.message_ids[chat_id]
+
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+
+        self.messages[chat_id].append(dict(message, received=time.perf_counter()))
+        self.events[chat_id].set()
+        return message
+
+    def on_getme(self, params):
+        return BOT_USER
+
+    def on_sendmessage(self, params):
+        return self._record(int(params["chat_id"]), params)
+
+    def on_editmessagetext(self, params):
+        return self._record(int(params["chat_id"]), params, message_id=int(params["message_id"]))
+
+    async def wait_for(self, chat_id, predicate, start=0, timeout=120):
+        # Ищет первое сообщение в чате, начиная с индекса start; возвращает (индекс, сообщение)
+        deadline = time.monotonic() + timeout
+        while True:
+            messages = self.messages[chat_id]
+            for i in range(start, len(messages)):
+                if predicate(messages[i]):
+                    return i, messages[i]
+            start = len(messages)
+
+            event = self.events[chat_id]
+            event.clear()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"Нет ожидаемого сообщения в чате {chat_id}")
+            try:
+                await asyncio.wait_for(event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
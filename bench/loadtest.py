@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+from collections import defaultdict
+
+from bench.fake_api import BOT_USER, FakeTelegram
+
+VOCABULARY = ["кот", "пес", "дом", "лес", "море", "снег", "чай", "сыр", "мяч", "торт", "луна", "река"]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def is_round_prompt(message):
+    return message["text"].startswith("🔔") or "ЭКСПРЕСС (Важен порядок!)" in message["text"]
+
+
+class LoadTest:
+    def __init__(self, app, api, rooms, players, think_time):
+        self.app = app
+        self.api = api
+        self.rooms = rooms
+        self.players = players
+        self.think_time = think_time
+        self.latencies = defaultdict(list)
+        self.round_times = []
+        self.update_id = 0
+        self.message_id = 0
+        self.user_base = random.randint(1, 1000) * 1_000_000
+
+    @staticmethod
+    def user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"Игрок {user_id}"}
+
+    async def feed(self, name, payload):
+        from aiogram import types
+
+        self.update_id += 1
+        update = types.Update.model_validate({"update_id": self.update_id, **payload}, context={"bot": self.app.bot})
+        started = time.perf_counter()
+        await self.app.dp.feed_update(self.app.bot, update)
+        self.latencies[name].append(time.perf_counter() - started)
+
+    async def send_text(self, name, user_id, text):
+        self.message_id += 1
+        await self.feed(name, {"message": {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id),
+            "text": text,
+        }})
+
+    async def press(self, name, user_id, message, data):
+        message = {k: v for k, v in message.items() if k != "received"}
+        await self.feed(name, {"callback_query": {
+            "id": str(self.update_id),
+            "from": self.user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": dict(message, **{"from": BOT_USER}),
+        }})
+
+    async def play_round(self, user_id, cursors):
+        index, _ = await self.api.wait_for(user_id, is_round_prompt, start=cursors[user_id])
+        cursors[user_id] = index + 1
+
+        await asyncio.sleep(random.uniform(0, self.think_time))
+        answers = "\n".join(random.sample(VOCABULARY, 6))
+        await self.send_text("receive_answer", user_id, answers)
+
+        index, accepted = await self.api.wait_for(user_id, lambda m: m["text"].startswith("Принято"),
+                                                  start=cursors[user_id])
+        cursors[user_id] = index + 1
+        await self.press("player_ready_handler", user_id, accepted, "player_ready")
+
+    async def run_room(self, room_index):
+        host = self.user_base + room_index * 1000
+        users = [host] + [host + i for i in range(1, self.players)]
+
+        await self.send_text("create_room", host, "Создать комнату")
+        _, lobby = await self.api.wait_for(host, lambda m: "Код комнаты" in m["text"])
+        code = re.search(r"Код комнаты: `?(\w{4,})", lobby["text"]).group(1)
+
+        for user_id in users[1:]:
+            await self.send_text("join_room", user_id, f"/join {code}")
+
+        cursors = {user_id: len(self.api.messages[user_id]) for user_id in users}
+        await self.press("start_game_handler", host, lobby, "start_game")
+
+        for _ in range(6):
+            _, prompt = await self.api.wait_for(host, is_round_prompt, start=cursors[host])
+            await asyncio.gather(*(self.play_round(user_id, cursors) for user_id in users))
+
+            index, panel = await self.api.wait_for(host, lambda m: "Панель Хоста" in m["text"], start=cursors[host])
+            cursors[host] = index + 1
+            self.round_times.append(panel["received"] - prompt["received"])
+            await self.press("host_next_round", host, panel, f"host_next_{code}")
+
+        await self.api.wait_for(host, lambda m: "ИГРА ОКОНЧЕНА" in m["text"], start=cursors[host])
+
+    async def run(self):
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.run_room(i) for i in range(self.rooms)), return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        failed = [r for r in results if isinstance(r, BaseException)]
+        for error in failed[:5]:
+            logging.error("Комната завершилась с ошибкой: %r", error)
+        return elapsed, len(failed)
+
+    def report(self, elapsed, failed):
+        lines = [f"Комнат: {self.rooms} × игроков: {self.players}, время: {elapsed:.1f} с, ошибок: {failed}", ""]
+        lines.append(f"{'хендлер':<24}{'n':>7}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+        rows = sorted(self.latencies.items())
+        if self.round_times:
+            rows.append(("раунд целиком", self.round_times))
+        for name, values in rows:
+            lines.append(f"{name:<24}{len(values):>7}" + "".join(
+                f"{percentile(values, q) * 1000:>10.1f}" for q in (50, 95, 99)))
+
+        lines.append("")
+        lines.append("Вызовы Bot API: " + ", ".join(f"{k}={v}" for k, v in sorted(self.api.calls.items())))
+        cache = self.app.player_cache
+        lines.append(f"Кэш игроков: попаданий {cache.hits}, промахов {cache.misses}")
+        lines.append("Запросы к БД:")
+        lines.append(self.app.query_metrics.summary())
+        return "\n".join(lines)
+
+
+async def run(args):
+    api = FakeTelegram(latency=args.api_latency / 1000)
+    api_url = await api.start(port=args.port)
+
+    os.environ["TELEGRAM_API_URL"] = api_url
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    if not args.real_limits:
+        os.environ.setdefault("BROADCAST_GLOBAL_RATE", "1000000")
+        os.environ.setdefault("BROADCAST_CHAT_RATE", "1000000")
+
+    import main as app
+
+    background_tasks = await app.on_startup()
+    try:
+        test = LoadTest(app, api, args.rooms, args.players, args.think_time)
+        elapsed, failed = await test.run()
+        print(test.report(elapsed, failed))
+    finally:
+        await app.on_shutdown(background_tasks)
+        await app.bot.session.close()
+        await api.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон: N комнат × M игроков против локального Bot API")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--players", type=int, default=5)
+    parser.add_argument("--think-time", type=float, default=1.0, help="максимальная пауза игрока перед ответом, с")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--real-limits", action="store_true", help="не снимать лимиты рассылки")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args))
@@ -0,0 +1,182 @@
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+from sqlalchemy import select, update
+
+from broadcast import MESSAGE_LIMIT, split_message
+from database import Room
+from debounce import Debounce
+
+logger = logging.getLogger(__name__)
+
+SECTIONS = ("round", "progress", "leaderboard")
+TRUNCATED = "\n…"
+_MARKDOWN_SPECIAL = re.compile(r"([_*`\[])")
+
+
+def escape_markdown(text):
+    # Табло размечено старым Markdown, а aiogram.utils.markdown экранирует под MarkdownV2 —
+    # там в тексте остались бы обратные косые перед точками и скобками
+    return _MARKDOWN_SPECIAL.sub(r"\\\1", text)
+
+
+def _chat_gone(error):
+    # Бота удалили из группы или группы больше нет — только тогда табло отключается насовсем
+    return isinstance(error, TelegramForbiddenError) or "chat not found" in str(error)
+
+
+def _message_gone(error):
+    return "message to edit not found" in str(error) or "message can't be edited" in str(error)
+
+
+@dataclass
+class BoardState:
+    chat_id: int
+    message_id: Optional[int]
+    title: str
+    round: str = ""  # задание раунда или его итоги
+    progress: str = ""  # «Готовы n/N», игроки в лобби, предупреждение о времени
+    leaderboard: str = ""
+    last_edit: float = 0.0
+    refresher: Optional[Debounce] = None
+    rendered: Optional[str] = None
+
+
+class GroupBoards:
+    # Комната, привязанная к групповому чату, показывает ход игры в одном закреплённом сообщении.
+    # Изменения копятся и выкладываются одной правкой через window секунд, но не чаще раза в interval
+    # секунд — в группу Telegram пропускает около 20 сообщений в минуту.
+    # on_undelivered(room_code, text) — текст не попал в группу, его нужно раздать игрокам в личку.
+    def __init__(self, bot, broadcaster, session_factory, window=1.0, interval=3.0, on_undelivered=None):
+        self.bot = bot
+        self.broadcaster = broadcaster
+        self.session_factory = session_factory
+        self.window = window
+        self.interval = interval
+        self.on_undelivered = on_undelivered
+        self.boards = {}
+
+    def __contains__(self, room_code):
+        return room_code in self.boards
+
+    async def attach(self, session, room, chat_id, **sections):
+        # Новое табло в группе; старое, если комнату перепривязали, просто перестаёт обновляться
+        self.drop(room.code)
+        state = BoardState(chat_id, None, f"🎲 **СмыСЛов — комната {room.code}**", **sections)
+        text = self._render(state)
+        delivery = await self.broadcaster.send(chat_id, text, parse_mode="Markdown")
+        if not delivery.ok:
+            return False
+        state.message_id = delivery.message.message_id
+        state.rendered = text
+        state.last_edit = time.monotonic()
+        self.boards[room.code] = state
+        room.group_chat_id = chat_id
+        room.board_message_id = state.message_id
+        await session.commit()
+        await self._pin(state)
+        return True
+
+    async def restore(self):
+        async with self.session_factory() as session:
+            rows = (await session.execute(
+                select(Room.code, Room.group_chat_id, Room.board_message_id).where(
+                    Room.group_chat_id != None))).all()
+        for code, chat_id, message_id in rows:
+            self.boards[code] = BoardState(chat_id, message_id, f"🎲 **СмыСЛов — комната {code}**")
+        if rows:
+            logger.info("Восстановлено табло групповых комнат: %s", len(rows))
+
+    def update(self, room_code, **sections):
+        # False — комната играет в личных сообщениях, и вызывающий отправляет всё сам
+        state = self.boards.get(room_code)
+        if state is None:
+            return False
+        for name, value in sections.items():
+            if name not in SECTIONS:
+                raise TypeError(f"Неизвестный раздел табло: {name}")
+            setattr(state, name, value)
+        if state.refresher is None:
+            state.refresher = Debounce(
+                lambda: self._refresh(room_code, state),
+                lambda: self.boards.get(room_code) is state and state.rendered != self._render(state),
+                f"табло комнаты {room_code}", "board_refresh")
+        state.refresher.schedule(max(time.monotonic() + self.window, state.last_edit + self.interval))
+        return True
+
+    async def flush(self, room_code):
+        # Последнее состояние табло перед тем, как комната будет удалена
+        state = self.boards.get(room_code)
+        if state is None:
+            return
+        if state.refresher is not None:
+            state.refresher.cancel()
+        if state.rendered != self._render(state):
+            await self._refresh(room_code, state)
+
+    def drop(self, room_code):
+        state = self.boards.pop(room_code, None)
+        if state is not None and state.refresher is not None:
+            state.refresher.cancel()
+
+    @staticmethod
+    def _render(state):
+        parts = [part for part in [state.title] + [getattr(state, name) for name in SECTIONS] if part]
+        text = "\n\n".join(parts)
+        if len(text) > MESSAGE_LIMIT:
+            # Табло — одно сообщение: длинные итоги раунда обрезаются по строкам, остальные разделы остаются
+            budget = MESSAGE_LIMIT - (len(text) - len(state.round)) - len(TRUNCATED)
+            if state.round and budget > 0:
+                parts[parts.index(state.round)] = split_message(state.round, budget)[0] + TRUNCATED
+                text = "\n\n".join(parts)
+            text = split_message(text)[0]
+        return text
+
+    async def _refresh(self, room_code, state):
+        text = self._render(state)
+        state.last_edit = time.monotonic()
+        delivery = None
+        if state.message_id is not None:
+            delivery = await self.broadcaster.edit(state.chat_id, state.message_id, text, parse_mode="Markdown")
+            # После перезапуска текст табло неизвестен, и правка может совпасть с ним
+            if delivery.ok or "message is not modified" in str(delivery.error):
+                state.rendered = text
+                return
+        if delivery is None or _message_gone(delivery.error):
+            # Табло удалили из группы — выкладываем новое и закрепляем его
+            delivery = await self.broadcaster.send(state.chat_id, text, parse_mode="Markdown")
+            if delivery.ok:
+                state.message_id = delivery.message.message_id
+                state.rendered = text
+                await self._pin(state)
+                await self._store(room_code, board_message_id=state.message_id)
+                return
+
+        # Ту же правку по кругу не повторяем: следующее изменение табло попробует снова
+        state.rendered = text
+        if _chat_gone(delivery.error):
+            # В группу писать нельзя — комната возвращается к личным сообщениям
+            logger.warning("Табло комнаты %s отключено: чат %s недоступен", room_code, state.chat_id)
+            self.drop(room_code)
+            await self._store(room_code, group_chat_id=None, board_message_id=None)
+        else:
+            logger.warning("Не удалось обновить табло комнаты %s: %s", room_code, delivery.error)
+        if self.on_undelivered is not None:
+            # update() уже ответил True, и вызывающий ничего не разослал сам — иначе этот текст потерялся бы
+            await self.on_undelivered(room_code, text)
+
+    async def _store(self, room_code, **values):
+        async with self.session_factory() as session:
+            await session.execute(update(Room).where(Room.code == room_code).values(**values))
+            await session.commit()
+
+    async def _pin(self, state):
+        # Закрепить можно, только если бот — администратор группы; без этого табло всё равно работает
+        try:
+            await self.bot.pin_chat_message(state.chat_id, state.message_id, disable_notification=True)
+        except TelegramAPIError as e:
+            logger.info("Не удалось закрепить табло в чате %s: %s", state.chat_id, e)
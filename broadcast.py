@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+logger = logging.getLogger(__name__)
+
+# Telegram принимает до 4096 символов текста; запас — на эмодзи, которые считаются за два
+MESSAGE_LIMIT = 4000
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    # Режет по строкам, чтобы не разорвать разметку посреди строки; слишком длинная строка режется как есть
+    chunks, current = [], ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + 1 + len(line) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current or not chunks:
+        chunks.append(current)
+    return chunks
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class Delivery:
+    chat_id: int
+    message: Optional[types.Message] = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class Broadcaster:
+    # Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+    def __init__(self, bot: Bot, concurrency=20, global_rate=30, chat_rate=1, chat_burst=3, max_retries=3):
+        self.bot = bot
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.max_retries = max_retries
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {k: b for k, b in self.chat_buckets.items() if not b.is_full()}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _call(self, chat_id, method, **kwargs):
+        attempt = 0
+        while True:
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                return Delivery(chat_id, message=await method(chat_id=chat_id, **kwargs))
+            except TelegramRetryAfter as e:
+                delay = e.retry_after
+                error = e
+            except (TelegramNetworkError, TelegramServerError) as e:
+                delay = 2 ** attempt
+                error = e
+            except TelegramAPIError as e:
+                logger.warning("Не удалось отправить сообщение в чат %s: %s", chat_id, e)
+                return Delivery(chat_id, error=e)
+
+            attempt += 1
+            if attempt > self.max_retries:
+                logger.warning("Не удалось отправить сообщение в чат %s после %s попыток: %s", chat_id, attempt, error)
+                return Delivery(chat_id, error=error)
+            await asyncio.sleep(delay)
+
+    async def send(self, chat_id, text, **kwargs):
+        # Длинный текст уходит несколькими сообщениями; клавиатура — у последнего, его и возвращаем
+        *head, tail = split_message(text)
+        markup = kwargs.pop("reply_markup", None)
+        async with self.semaphore:
+            for chunk in head:
+                delivery = await self._call(chat_id, self.bot.send_message, text=chunk, **kwargs)
+                if not delivery.ok:
+                    return delivery
+            return await self._call(chat_id, self.bot.send_message, text=tail, reply_markup=markup, **kwargs)
+
+    async def edit(self, chat_id, message_id, text, **kwargs):
+        async with self.semaphore:
+            return await self._call(chat_id, self.bot.edit_message_text, message_id=message_id, text=text, **kwargs)
+
+    async def broadcast(self, chat_ids, text, **kwargs):
+        return await asyncio.gather(*(self.send(chat_id, text, **kwargs) for chat_id in chat_ids))
+
+    async def send_many(self, messages):
+        # messages: [(chat_id, text, kwargs), ...] — разный текст для разных получателей
+        return await asyncio.gather(*(self.send(chat_id, text, **kwargs) for chat_id, text, kwargs in messages))
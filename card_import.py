@@ -0,0 +1,88 @@
+import csv
+import io
+from dataclasses import dataclass
+
+from sqlalchemy import insert, select
+
+from database import Card
+
+EXPRESS_PARTS = 6
+MAX_CARDS_PER_IMPORT = 500
+MAX_CARD_LENGTH = 300
+MAX_FILE_SIZE = 512 * 1024
+ALLOWED_EXTENSIONS = (".txt", ".csv")
+# Строк в одном INSERT ... VALUES: 3 параметра на строку укладываются в лимит SQLite в 999 параметров
+INSERT_CHUNK = 300
+
+
+@dataclass
+class ImportResult:
+    added: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    truncated: int = 0
+
+
+def split_text(text, mode):
+    if mode == "standard":
+        return text.replace(',', '\n').split('\n')
+    return text.split('\n')
+
+
+def split_csv(text, mode):
+    entries = []
+    for row in csv.reader(io.StringIO(text)):
+        if mode == "express" and len(row) > 1:
+            entries.append("|".join(row))
+        else:
+            entries.extend(row)
+    return entries
+
+
+def normalize_card(entry, is_blitz):
+    if is_blitz:
+        parts = [" ".join(part.split()) for part in entry.split('|')]
+        if len(parts) != EXPRESS_PARTS or not all(parts):
+            return None
+        text = "|".join(parts)
+    else:
+        text = " ".join(entry.split())
+    if not text or len(text) > MAX_CARD_LENGTH:
+        return None
+    return text
+
+
+def card_key(text):
+    return text.lower().replace('ё', 'е')
+
+
+async def import_cards(session, room_code, entries, is_blitz):
+    result = ImportResult()
+
+    existing = await session.execute(
+        select(Card.text).where(Card.room_code == room_code, Card.is_blitz == is_blitz))
+    seen = {card_key(text) for text in existing.scalars()}
+
+    rows = []
+    for entry in entries:
+        if not entry.strip():
+            continue
+        text = normalize_card(entry, is_blitz)
+        if text is None:
+            result.invalid += 1
+            continue
+        key = card_key(text)
+        if key in seen:
+            result.duplicates += 1
+            continue
+        if len(rows) >= MAX_CARDS_PER_IMPORT:
+            result.truncated += 1
+            continue
+        seen.add(key)
+        rows.append({"text": text, "is_blitz": is_blitz, "room_code": room_code})
+
+    # Многострочный INSERT ... VALUES: executemany в asyncpg — это всё равно по запросу на строку
+    for start in range(0, len(rows), INSERT_CHUNK):
+        await session.execute(insert(Card).values(rows[start:start + INSERT_CHUNK]))
+    result.added = len(rows)
+    return result
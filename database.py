@@ -1,9 +1,30 @@
-from sqlalchemy import BigInteger, String, Boolean, ForeignKey, Integer, select
+from datetime import datetime, timezone
+from sqlalchemy import BigInteger, String, Boolean, DateTime, ForeignKey, Index, Integer, JSON, inspect, literal, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from config import DB_URL
+from config import (DB_URL, DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_STATEMENT_CACHE_SIZE,
+                    ROUND_DURATION)
+from metrics import TimedQueuePool, query_metrics
 
-engine = create_async_engine(DB_URL, echo=False)
+
+def engine_options():
+    # У SQLite свой пул без очереди, настройки размера к нему не применимы
+    if DB_URL.startswith("sqlite"):
+        return {}
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if DB_URL.startswith("postgresql+asyncpg"):
+        options["connect_args"] = {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    return options
+
+
+engine = create_async_engine(DB_URL, echo=False, **engine_options())
+query_metrics.instrument(engine)
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 
@@ -11,72 +32,156 @@ class Base(DeclarativeBase):
     pass
 
 
+class CardPack(Base):
+    __tablename__ = "card_packs"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String, unique=True, nullable=False)
+    version: Mapped[int] = mapped_column(Integer, default=1)
+    checksum: Mapped[str] = mapped_column(String(64), nullable=False)
+
+
 class Card(Base):
     __tablename__ = "cards"
+    __table_args__ = (Index("ix_cards_room_code_is_blitz", "room_code", "is_blitz"),)
     id: Mapped[int] = mapped_column(primary_key=True)
     text: Mapped[str] = mapped_column(String, nullable=False)
     is_blitz: Mapped[bool] = mapped_column(Boolean, default=False)
-    room_code: Mapped[str] = mapped_column(String(4), nullable=True)
+    room_code: Mapped[str] = mapped_column(String(8), nullable=True)
+    pack_id: Mapped[int] = mapped_column(ForeignKey("card_packs.id", ondelete="CASCADE"), nullable=True)
 
 
 class Room(Base):
     __tablename__ = "rooms"
-    code: Mapped[str] = mapped_column(String(4), primary_key=True)
+    code: Mapped[str] = mapped_column(String(8), primary_key=True)
     host_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     status: Mapped[str] = mapped_column(String, default="waiting")  # waiting, playing, finished
     round_number: Mapped[int] = mapped_column(Integer, default=0)
     current_card_text: Mapped[str] = mapped_column(String, nullable=True)
+    deck: Mapped[dict] = mapped_column(JSON, nullable=True)  # {"standard": [card_id, ...], "express": [...]}
+    round_duration: Mapped[int] = mapped_column(Integer, default=ROUND_DURATION)  # секунды
+    round_deadline: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_activity: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True,
+                                                    default=lambda: datetime.now(timezone.utc))
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True,
+                                                 default=lambda: datetime.now(timezone.utc))
+    # Групповой чат, где идёт табло комнаты; NULL — игра только в личных сообщениях
+    group_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    board_message_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    tournament_id: Mapped[int] = mapped_column(ForeignKey("tournaments.id", ondelete="SET NULL"), nullable=True)
 
     players: Mapped[list["Player"]] = relationship(back_populates="room", cascade="all, delete-orphan")
 
 
+class Tournament(Base):
+    # Несколько комнат (и игр), чьи очки идут в одну общую таблицу
+    __tablename__ = "tournaments"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String, nullable=False)
+    owner_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    # Растёт с каждым изменением tournament_scores — по ней воркер видит, что его таблица в памяти отстала
+    version: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+
+class TournamentScore(Base):
+    # Сводная таблица турнира: обновляется приращениями, а не пересчётом по комнатам
+    __tablename__ = "tournament_scores"
+    tournament_id: Mapped[int] = mapped_column(ForeignKey("tournaments.id", ondelete="CASCADE"), primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    username: Mapped[str] = mapped_column(String, nullable=True)
+    score: Mapped[int] = mapped_column(Integer, default=0)
+    games: Mapped[int] = mapped_column(Integer, default=0)
+
+
 class Player(Base):
     __tablename__ = "players"
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(BigInteger)
+    user_id: Mapped[int] = mapped_column(BigInteger, index=True)
     username: Mapped[str] = mapped_column(String, nullable=True)
-    room_code: Mapped[str] = mapped_column(ForeignKey("rooms.code"))
+    room_code: Mapped[str] = mapped_column(ForeignKey("rooms.code"), index=True)
     score: Mapped[int] = mapped_column(Integer, default=0)
-    current_answers: Mapped[str] = mapped_column(String, nullable=True)  # Ответы через разделитель
     is_ready: Mapped[bool] = mapped_column(Boolean, default=False)
     room: Mapped["Room"] = relationship(back_populates="players")
 
 
+class RoundAnswer(Base):
+    __tablename__ = "round_answers"
+    __table_args__ = (Index("ix_round_answers_match", "room_code", "round_number", "position", "normalized"),
+                      Index("ix_round_answers_match_stemmed", "room_code", "round_number", "position", "stemmed"))
+    id: Mapped[int] = mapped_column(primary_key=True)
+    player_id: Mapped[int] = mapped_column(ForeignKey("players.id", ondelete="CASCADE"), index=True)
+    room_code: Mapped[str] = mapped_column(String(8))
+    round_number: Mapped[int] = mapped_column(Integer)
+    position: Mapped[int] = mapped_column(Integer)
+    raw: Mapped[str] = mapped_column(String)
+    normalized: Mapped[str] = mapped_column(String)  # Считается один раз при отправке
+    stemmed: Mapped[str] = mapped_column(String, nullable=True)  # normalized без окончаний, для строгости stemmed
+
+
+class GameEvent(Base):
+    # Журнал только на добавление: пишется пачками в фоне и не чистится вместе с комнатой
+    __tablename__ = "game_events"
+    __table_args__ = (Index("ix_game_events_room_code_created_at", "room_code", "created_at"),)
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+    kind: Mapped[str] = mapped_column(String(32))
+    room_code: Mapped[str] = mapped_column(String(8))
+    user_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    round_number: Mapped[int] = mapped_column(Integer, nullable=True)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=True)
+
+
+class GameResult(Base):
+    # Итог игры, который остаётся после удаления комнаты
+    __tablename__ = "game_results"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    room_code: Mapped[str] = mapped_column(String(8), index=True)
+    host_id: Mapped[int] = mapped_column(BigInteger)
+    tournament_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+    rounds_played: Mapped[int] = mapped_column(Integer)
+    stopped: Mapped[bool] = mapped_column(Boolean, default=False)  # остановлена хостом до конца
+    standings: Mapped[list] = mapped_column(JSON)  # [{"user_id", "username", "score"}, ...] по убыванию очков
+
+
+def _upgrade_schema(conn):
+    # create_all не меняет уже существующие таблицы, поэтому базе от прежних версий бота
+    # досоздаём недостающие колонки и индексы и расширяем строковые колонки (коды комнат 4 -> 8).
+    # Всё идемпотентно: на свежей базе делать нечего.
+    inspector = inspect(conn)
+    quote = conn.dialect.identifier_preparer.quote
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            old = existing.get(column.name)
+            if old is not None:
+                length = getattr(column.type, "length", None)
+                if (conn.dialect.name == "postgresql" and length
+                        and (getattr(old["type"], "length", None) or length) < length):
+                    conn.exec_driver_sql(f"ALTER TABLE {quote(table.name)} ALTER COLUMN {quote(column.name)} "
+                                         f"TYPE {column.type.compile(conn.dialect)}")
+                continue
+            ddl = (f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} "
+                   f"{column.type.compile(conn.dialect)}")
+            if column.default is not None and column.default.is_scalar:
+                value = literal(column.default.arg, column.type)
+                ddl += " DEFAULT " + str(value.compile(conn, compile_kwargs={"literal_binds": True}))
+            for fk in column.foreign_keys:
+                ddl += f" REFERENCES {quote(fk.column.table.name)} ({quote(fk.column.name)})"
+                if fk.ondelete:
+                    ddl += f" ON DELETE {fk.ondelete}"
+            conn.exec_driver_sql(ddl)
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(conn)
+    # У комнат из старой базы нет отметки активности — считаем их активными с момента обновления,
+    # иначе уборщик их никогда не увидит
+    conn.execute(text("UPDATE rooms SET last_activity = CURRENT_TIMESTAMP WHERE last_activity IS NULL"))
+
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-
-    async with async_session() as session:
-        result = await session.execute(select(Card))
-        if not result.scalars().first():
-            defaults = [
-                Card(text="Кошки"), Card(text="Ванная комната"),
-                Card(text="Почта"), Card(text="Грибы"),
-                Card(text="Школа"), Card(text="Япония"),
-                Card(text="Обитатели зоопарка"), Card(text="Кухни"),
-                Card(text="Металлы"), Card(text="Транспортные средства"),
-                Card(text="Грызуны"), Card(text="Футбольные клубы"),
-                Card(text="Созвездия"), Card(text="Российские музыкальные исполнители"),
-                Card(text="Настольные игры"), Card(text="Канцелярские принадлежности"),
-                Card(text="Фрукты"), Card(text="Марки машин"),
-                Card(text="Сказки"), Card(text="Цвета"),
-                Card(text="Выпечка"), Card(text="Танцы"),
-                Card(text="Существительные заканчивающиеся на «-аль»"), Card(text="Детективные фильмы и сериалы"),
-                Card(text="Фильмы и сериалы про войну"), Card(text="Центр города"),
-                Card(text="Цирк"), Card(text="Книги, в названии которых есть числительное"),
-                Card(text="Электрические приборы"), Card(text="Архитектурные сооружения"),
-                Card(text="Зарубежные актёры"), Card(text="Персонажи мультфильмов"),
-                Card(text="Кофе|Монета|Капитан ...|Жалящее насекомое|Головной убор|Чувство", is_blitz=True),
-                Card(text="Пирожное|Слово, заканчивающееся на «-но»|Музыкальная группа 90-х|Торговая сеть|Фокусник|Ирландия", is_blitz=True),
-                Card(text="Флот|Ландшафт|Известная Наталья|Островное государство|Дорожный Знак|Комик", is_blitz=True),
-                Card(text="Маргарита|Воинское звание|Известное высотное сооружение|Римский император|Компьютерная игра|Обезьяна", is_blitz=True),
-                Card(text="Дворец|Сектор|Фильм про шпионов|Начинка для конфет|Нелетающая птица|Солнце", is_blitz=True),
-                Card(text="Царь из сказки|Известная пара|Ядовитое растение|Пушной зверь|Гоночный автомобиль|Деталь музыкального инструмента", is_blitz=True),
-                Card(text="Сахар|Германия|Популярная профессия|Водный вид спорта|Герой анекдота|Ящерица", is_blitz=True),
-                Card(text="Испания|Метательное оружие|Киностудия|Культурное растение|Начинка для пиццы|Муза", is_blitz=True),
-                Card(text="Кубок|Порода маленьких собак|Промежуток времени|Чистящее средство|Земля|Банк", is_blitz=True),
-                Card(text="Физик|Рок-н-ролл|Аттракцион|Известный Михаил|Ювелирное украшение|Баскетбол", is_blitz=True),
-                Card(text="Змея|Река|Спорт|Птица|Авто|Инструмент", is_blitz=True)
-            ]
-            session.add_all(defaults)
-            await session.commit()
\ No newline at end of file
+        await conn.run_sync(_upgrade_schema)
@@ -0,0 +1,44 @@
+import asyncio
+import logging
+import time
+
+from metrics import spawn
+
+logger = logging.getLogger(__name__)
+
+
+class Debounce:
+    # Отложенное действие с одной задачей на владельца: schedule(due) сдвигает срок, action() выполняется,
+    # когда срок наступил, и повторяется, пока pending() истинно — изменения могли прийти во время записи.
+    # pending() должен становиться ложным, когда владелец удалён, — тогда задача тихо завершается.
+    # Ошибка action() пишется в лог и останавливает задачу до следующего schedule().
+    # Запросы задачи считаются в метриках под именем handler, а не хендлера, который её запустил.
+    def __init__(self, action, pending, name, handler):
+        self.action = action
+        self.pending = pending
+        self.name = name
+        self.handler = handler
+        self.due = 0.0
+        self.task = None
+
+    def schedule(self, due):
+        self.due = due
+        if self.task is None or self.task.done():
+            self.task = spawn(self.handler, self._run())
+
+    async def _run(self):
+        while self.pending():
+            while (delay := self.due - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            if not self.pending():
+                return
+            try:
+                await self.action()
+            except Exception:
+                logger.exception("Отложенное действие не выполнено: %s", self.name)
+                return
+
+    def cancel(self):
+        # Из самого действия задачу не отменяем — оно завершится и увидит, что pending() ложно
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
@@ -0,0 +1,45 @@
+import random
+
+from sqlalchemy import select
+
+from database import Card
+from packs import default_deck
+
+
+def deck_key(is_blitz):
+    return "express" if is_blitz else "standard"
+
+
+async def _custom_ids(session, room_code, is_blitz):
+    stmt = select(Card.id).where(Card.room_code == room_code, Card.is_blitz == is_blitz)
+    return list((await session.execute(stmt)).scalars().all())
+
+
+async def build_deck(session, room_code, rounds):
+    # rounds: {"standard": 4, "express": 2} — сколько карт каждого типа понадобится за игру
+    deck = {}
+    for is_blitz in (False, True):
+        key = deck_key(is_blitz)
+        count = rounds.get(key, 0)
+
+        custom_ids = await _custom_ids(session, room_code, is_blitz)
+        random.shuffle(custom_ids)
+        ids = custom_ids[:count]
+        if len(ids) < count:
+            ids += default_deck.sample(is_blitz, count - len(ids))
+        deck[key] = ids
+    return deck
+
+
+async def draw_card(session, deck, is_blitz):
+    # Колода не меняется на месте: возвращается карта и новая колода без неё
+    key = deck_key(is_blitz)
+    deck = deck or {}
+    ids = deck.get(key) or []
+
+    card = None
+    while ids and card is None:
+        card_id, ids = ids[0], ids[1:]
+        card = default_deck.get(card_id) or await session.get(Card, card_id)
+
+    return card, {**deck, key: ids}
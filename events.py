@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+
+from database import GameEvent, GameResult
+
+logger = logging.getLogger(__name__)
+
+ROOM_CREATED = "room_created"
+PLAYER_JOINED = "player_joined"
+PLAYER_LEFT = "player_left"
+ROUND_STARTED = "round_started"
+ANSWERS_SUBMITTED = "answers_submitted"
+SCORES_ADJUSTED = "scores_adjusted"
+GAME_FINISHED = "game_finished"
+GAME_STOPPED = "game_stopped"
+ROOM_SWEPT = "room_swept"
+
+
+class EventLog:
+    # События копятся в памяти и пишутся одним INSERT пачками по batch_size — хендлеры не ждут БД.
+    # Если БД недоступна дольше, чем помещается в max_pending, самые старые события теряются.
+    def __init__(self, session_factory, batch_size=500, flush_interval=2.0, max_pending=50000):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = []
+        self.dropped = 0
+        self.flush_lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+
+    def record(self, kind, room_code, user_id=None, round_number=None, **payload):
+        self.pending.append({
+            "created_at": datetime.now(timezone.utc),
+            "kind": kind,
+            "room_code": room_code,
+            "user_id": user_id,
+            "round_number": round_number,
+            "payload": payload or None,
+        })
+        if len(self.pending) > self.max_pending:
+            overflow = len(self.pending) - self.max_pending
+            del self.pending[:overflow]
+            self.dropped += overflow
+            logger.warning("Журнал событий переполнен, потеряно событий: %s", self.dropped)
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    async def flush(self):
+        async with self.flush_lock:
+            written = 0
+            while self.pending:
+                batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+                try:
+                    async with self.session_factory() as session:
+                        await session.execute(insert(GameEvent), batch)
+                        await session.commit()
+                except Exception:
+                    self.pending[:0] = batch
+                    raise
+                written += len(batch)
+            return written
+
+    async def run_flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Не удалось записать журнал событий")
+
+    async def close(self):
+        await self.flush()
+
+
+async def archive_game(session, room, players, stopped=False):
+    # Пишется в той же транзакции, что и удаление комнаты: итог либо сохранён, либо комната осталась
+    standings = sorted(players, key=lambda p: p.score, reverse=True)
+    await session.execute(insert(GameResult).values(
+        room_code=room.code,
+        host_id=room.host_id,
+        tournament_id=room.tournament_id,
+        started_at=room.created_at,
+        finished_at=datetime.now(timezone.utc),
+        rounds_played=room.round_number,
+        stopped=stopped,
+        standings=[{"user_id": p.user_id, "username": p.username, "score": p.score} for p in standings],
+    ))
@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import csv
+import json
+import sys
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from database import GameEvent, GameResult, async_session
+
+SOURCES = {
+    "events": (GameEvent, GameEvent.created_at,
+               ["id", "created_at", "kind", "room_code", "user_id", "round_number", "payload"]),
+    "results": (GameResult, GameResult.finished_at,
+                ["id", "room_code", "host_id", "started_at", "finished_at", "rounds_played", "stopped", "standings"]),
+}
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+async def stream_rows(session, source, since=None, room_code=None, chunk_size=1000):
+    # Строки идут с серверного курсора пачками по chunk_size, так что память не растёт вместе с историей
+    model, timestamp, columns = SOURCES[source]
+    stmt = select(*(getattr(model, name) for name in columns)).order_by(model.id)
+    if since is not None:
+        stmt = stmt.where(timestamp >= since)
+    if room_code is not None:
+        stmt = stmt.where(model.room_code == room_code)
+    result = await session.stream(stmt.execution_options(yield_per=chunk_size))
+    async for row in result:
+        yield dict(zip(columns, map(_plain, row)))
+
+
+async def ndjson_lines(rows):
+    async for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+async def csv_lines(rows, columns):
+    # csv.writer пишет в буфер одной строки, а вложенный JSON (payload, standings) кладётся в ячейку строкой
+    line = _LineBuffer()
+    writer = csv.writer(line)
+    writer.writerow(columns)
+    yield line.pop()
+    async for row in rows:
+        writer.writerow([json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v
+                         for v in row.values()])
+        yield line.pop()
+
+
+class _LineBuffer:
+    def __init__(self):
+        self.value = ""
+
+    def write(self, text):
+        self.value += text
+
+    def pop(self):
+        value, self.value = self.value, ""
+        return value
+
+
+async def export(source, fmt="ndjson", since=None, room_code=None, out=sys.stdout):
+    async with async_session() as session:
+        rows = stream_rows(session, source, since, room_code)
+        lines = csv_lines(rows, SOURCES[source][2]) if fmt == "csv" else ndjson_lines(rows)
+        count = 0
+        async for line in lines:
+            out.write(line)
+            count += 1
+        return count
+
+
+def parse_since(value):
+    since = datetime.fromisoformat(value)
+    return since if since.tzinfo else since.replace(tzinfo=timezone.utc)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Выгрузка истории игр (журнал событий или итоги) в NDJSON или CSV")
+    parser.add_argument("source", choices=list(SOURCES))
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--since", type=parse_since, help="только записи не раньше даты, например 2024-05-01")
+    parser.add_argument("--room", type=str.upper, help="только одна комната")
+    parser.add_argument("--output", help="файл; по умолчанию stdout")
+    args = parser.parse_args()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            asyncio.run(export(args.source, args.format, args.since, args.room, f))
+    else:
+        asyncio.run(export(args.source, args.format, args.since, args.room))
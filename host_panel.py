@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from aiogram import types
+from sqlalchemy import bindparam, select, update
+
+from database import Player, Room
+from debounce import Debounce
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 8
+PANEL_HINT = "\n\n👮‍♂️ **Панель Хоста**:\nНажмите на игрока, чтобы исправить очки, если робот ошибся."
+PANEL_HEADER = "📊 **Панель управления**"
+
+_players = Player.__table__
+_add_score = update(_players).where(_players.c.id == bindparam("player_id")).values(
+    score=_players.c.score + bindparam("delta"))
+
+
+@dataclass
+class PanelState:
+    chat_id: int
+    message_id: Optional[int]
+    header: str
+    players: Dict[int, list]  # player_id -> [имя, очки в БД]
+    page: int = 0
+    editing: Optional[int] = None  # игрок, чьи очки сейчас правит хост
+    pending: Counter = field(default_factory=Counter)  # ещё не записанные ±1
+    flusher: Optional[Debounce] = None
+    keyboards: dict = field(default_factory=dict)  # страница -> клавиатура списка
+    rendered: Optional[tuple] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)  # одна запись правок за раз
+
+    def score(self, player_id):
+        return self.players[player_id][1] + self.pending[player_id]
+
+    @property
+    def pages(self):
+        return max(1, -(-len(self.players) // PAGE_SIZE))
+
+
+class HostPanels:
+    # Панель хоста — одно сообщение, которое редактируется на месте: список игроков по страницам
+    # или правка очков одного игрока. Нажатия ±1 копятся в памяти; через window секунд без нажатий
+    # они записываются одним запросом, и сообщение перерисовывается один раз.
+    # await on_flushed(room_code, deltas) — после записи; deltas — {player_id: изменение очков}.
+    def __init__(self, broadcaster, session_factory, window=1.0, on_flushed=None):
+        self.broadcaster = broadcaster
+        self.session_factory = session_factory
+        self.window = window
+        self.on_flushed = on_flushed
+        self.panels = {}
+
+    async def show(self, chat_id, room_code, summary, players):
+        # Новая панель после подсчёта раунда — единственное сообщение, которое отправляется заново.
+        # Итоги раунда идут отдельными сообщениями: в большой комнате они не влезают в одно,
+        # а панель с кнопкой «Следующий раунд» должна дойти при любом размере комнаты
+        self.drop(room_code)
+        await self.broadcaster.send(chat_id, summary, parse_mode="Markdown")
+        roster = {p.id: [p.username, p.score] for p in sorted(players, key=lambda p: p.id)}
+        state = PanelState(chat_id, None, PANEL_HEADER, roster)
+        self.panels[room_code] = state
+        text, markup = self._render(room_code, state)
+        delivery = await self.broadcaster.send(chat_id, text, reply_markup=markup, parse_mode="Markdown")
+        if delivery.ok:
+            state.message_id = delivery.message.message_id
+            state.rendered = (text, markup)
+
+    async def open(self, session, room_code, message: types.Message):
+        # Панель могла остаться от перезапуска или другого воркера — собираем её заново по сообщению
+        state = self.panels.get(room_code)
+        if state is None or state.message_id != message.message_id:
+            players = (await session.execute(
+                select(Player.id, Player.username, Player.score).where(Player.room_code == room_code).order_by(
+                    Player.id))).all()
+            state = PanelState(message.chat.id, message.message_id, PANEL_HEADER,
+                               {p.id: [p.username, p.score] for p in players})
+            self.panels[room_code] = state
+        return state
+
+    async def show_page(self, session, room_code, message, page):
+        state = await self.open(session, room_code, message)
+        state.page = min(max(page, 0), state.pages - 1)
+        state.editing = None
+        await self._refresh(room_code, state)
+
+    async def edit_player(self, session, room_code, message, player_id):
+        state = await self.open(session, room_code, message)
+        if player_id not in state.players:
+            return None
+        state.editing = player_id
+        await self._refresh(room_code, state)
+        return state.players[player_id][0]
+
+    async def adjust(self, session, room_code, message, player_id, delta):
+        state = await self.open(session, room_code, message)
+        if player_id not in state.players:
+            return None
+        state.pending[player_id] += delta
+        state.editing = player_id
+        state.keyboards.clear()
+        if state.flusher is None:
+            state.flusher = Debounce(lambda: self._flush_and_refresh(room_code, state),
+                                     lambda: bool(state.pending) and self.panels.get(room_code) is state,
+                                     f"правки очков в комнате {room_code}", "host_panel_flush")
+        state.flusher.schedule(time.monotonic() + self.window)
+        return state.players[player_id][0], state.score(player_id)
+
+    async def _flush_and_refresh(self, room_code, state):
+        # Правка панели тоже под замком: flush() хоста дожидается её, прежде чем панель закроют
+        async with state.lock:
+            await self._write(room_code, state)
+            await self._refresh(room_code, state)
+
+    async def _flush(self, room_code, state):
+        async with state.lock:
+            await self._write(room_code, state)
+
+    async def _write(self, room_code, state):
+        deltas = {player_id: delta for player_id, delta in state.pending.items() if delta}
+        state.pending.clear()
+        if not deltas:
+            return
+        try:
+            async with self.session_factory() as session:
+                await session.execute(_add_score, [{"player_id": k, "delta": v} for k, v in deltas.items()])
+                await session.execute(
+                    update(Room).where(Room.code == room_code).values(last_activity=datetime.now(timezone.utc)))
+                await session.commit()
+        except Exception:
+            state.pending.update(deltas)
+            raise
+        for player_id, delta in deltas.items():
+            state.players[player_id][1] += delta
+        state.keyboards.clear()
+        if self.on_flushed is not None:
+            try:
+                await self.on_flushed(room_code, deltas)
+            except Exception:
+                logger.exception("Ошибка после записи правок очков в комнате %s", room_code)
+
+    async def flush(self, room_code):
+        # Под замком: если отложенная запись уже идёт, дожидаемся её, а не проскакиваем с пустым pending
+        state = self.panels.get(room_code)
+        if state is not None:
+            await self._flush(room_code, state)
+
+    def drop(self, room_code):
+        state = self.panels.pop(room_code, None)
+        if state is not None and state.flusher is not None:
+            state.flusher.cancel()
+
+    def _render(self, room_code, state):
+        if state.editing is not None:
+            player_id = state.editing
+            name = state.players[player_id][0]
+            markup = types.InlineKeyboardMarkup(inline_keyboard=[
+                [
+                    types.InlineKeyboardButton(text="➖ 1", callback_data=f"mod_score_-1_{player_id}_{room_code}"),
+                    types.InlineKeyboardButton(text=f"🏆 {state.score(player_id)}", callback_data="noop"),
+                    types.InlineKeyboardButton(text="➕ 1", callback_data=f"mod_score_+1_{player_id}_{room_code}")
+                ],
+                [types.InlineKeyboardButton(text="🔙 Назад к списку", callback_data=f"back_panel_{room_code}")]
+            ])
+            return f"Редактирование очков игрока **{name}**:", markup
+
+        markup = state.keyboards.get(state.page)
+        if markup is None:
+            page_ids = list(state.players)[state.page * PAGE_SIZE:(state.page + 1) * PAGE_SIZE]
+            keyboard = [
+                [types.InlineKeyboardButton(text=f"✏️ {state.players[pid][0]} ({state.score(pid)})",
+                                            callback_data=f"edit_score_{pid}_{room_code}")]
+                for pid in page_ids
+            ]
+            if state.pages > 1:
+                keyboard.append([
+                    types.InlineKeyboardButton(text="◀️", callback_data=f"panel_page_{state.page - 1}_{room_code}"),
+                    types.InlineKeyboardButton(text=f"{state.page + 1}/{state.pages}", callback_data="noop"),
+                    types.InlineKeyboardButton(text="▶️", callback_data=f"panel_page_{state.page + 1}_{room_code}"),
+                ])
+            keyboard.append(
+                [types.InlineKeyboardButton(text="➡️ Следующий раунд", callback_data=f"host_next_{room_code}")])
+            markup = state.keyboards[state.page] = types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+        return state.header + PANEL_HINT, markup
+
+    async def _refresh(self, room_code, state):
+        # Панель уже закрыта (раунд утверждён, игра остановлена) — её сообщение показывает другое
+        if self.panels.get(room_code) is not state:
+            return
+        text, markup = self._render(room_code, state)
+        # Telegram отвечает ошибкой на правку без изменений, поэтому одинаковое не отправляем
+        if state.message_id is None or state.rendered == (text, markup):
+            return
+        delivery = await self.broadcaster.edit(state.chat_id, state.message_id, text, reply_markup=markup,
+                                               parse_mode="Markdown")
+        if delivery.ok:
+            state.rendered = (text, markup)
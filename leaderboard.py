@@ -0,0 +1,200 @@
+import asyncio
+import heapq
+from collections import Counter, defaultdict
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from config import DB_URL
+from database import Tournament, TournamentScore
+
+
+class ScoreIndex:
+    # Дерево Фенвика по значениям очков: в ячейке — сколько игроков набрали столько очков.
+    # «Сколько игроков выше» и «k-й сверху» — за O(log S), где S — разброс очков в турнире.
+    # Диапазон растёт удвоением, когда очки выходят за его края (в том числе в минус после правок хоста).
+    def __init__(self, low=0, size=64):
+        self.low = low
+        self.size = size
+        self.tree = [0] * (size + 1)
+        self.counts = Counter()
+        self.total = 0
+
+    def _add(self, score, delta):
+        pos = score - self.low + 1
+        while pos <= self.size:
+            self.tree[pos] += delta
+            pos += pos & -pos
+
+    def _prefix(self, score):
+        # Сколько игроков набрали не больше score
+        pos = min(score - self.low + 1, self.size)
+        count = 0
+        while pos > 0:
+            count += self.tree[pos]
+            pos -= pos & -pos
+        return count
+
+    def _grow(self, score):
+        low, high = min(self.low, score), max(self.low + self.size - 1, score)
+        size = self.size
+        while size < 2 * (high - low + 1):
+            size *= 2
+        # Запас оставляем с той стороны, куда вышли очки
+        self.low = low if score >= self.low else high - size + 1
+        self.size = size
+        self.tree = [0] * (size + 1)
+        for value, count in self.counts.items():
+            self._add(value, count)
+
+    def add(self, score):
+        if not self.low <= score < self.low + self.size:
+            self._grow(score)
+        self.counts[score] += 1
+        self.total += 1
+        self._add(score, 1)
+
+    def remove(self, score):
+        self.counts[score] -= 1
+        if not self.counts[score]:
+            del self.counts[score]
+        self.total -= 1
+        self._add(score, -1)
+
+    def above(self, score):
+        return self.total - self._prefix(score)
+
+    def kth_from_top(self, k):
+        # Очки k-го игрока сверху (k от 1): ищем (total - k + 1)-го снизу спуском по дереву
+        rank = self.total - k + 1
+        pos = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] < rank:
+                pos = nxt
+                rank -= self.tree[nxt]
+            step >>= 1
+        return self.low + pos
+
+
+class Leaderboard:
+    def __init__(self, rows=()):
+        self.entries = {}  # user_id -> [очки, игр сыграно, имя]
+        self.by_score = defaultdict(set)
+        self.index = ScoreIndex()
+        for user_id, username, score, games in rows:
+            self.apply(user_id, username, score, games)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def apply(self, user_id, username, delta=0, games=0):
+        entry = self.entries.get(user_id)
+        if entry is None:
+            entry = self.entries[user_id] = [0, 0, username]
+            self.by_score[0].add(user_id)
+            self.index.add(0)
+        if delta:
+            self._move(user_id, entry[0], entry[0] + delta)
+            entry[0] += delta
+        entry[1] += games
+        if username:
+            entry[2] = username
+
+    def _move(self, user_id, old, new):
+        self.by_score[old].discard(user_id)
+        if not self.by_score[old]:
+            del self.by_score[old]
+        self.by_score[new].add(user_id)
+        self.index.remove(old)
+        self.index.add(new)
+
+    def place(self, user_id):
+        # (место, очки, игр); при равенстве очков место общее
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        return self.index.above(entry[0]) + 1, entry[0], entry[1]
+
+    def top(self, k):
+        # [(место, user_id, имя, очки, игр), ...]; внутри одного значения очков — по имени
+        rows = []
+        while len(rows) < min(k, len(self.entries)):
+            score = self.index.kth_from_top(len(rows) + 1)
+            place = len(rows) + 1
+            tied = heapq.nsmallest(k - len(rows), self.by_score[score],
+                                   key=lambda user_id: (self.entries[user_id][2] or "", user_id))
+            rows.extend((place, user_id, self.entries[user_id][2], score, self.entries[user_id][1])
+                        for user_id in tied)
+        return rows
+
+
+def _upsert():
+    # ON CONFLICT есть и в PostgreSQL, и в SQLite, но в SQLAlchemy он свой у каждого диалекта
+    stmt = (sqlite_insert if DB_URL.startswith("sqlite") else pg_insert)(TournamentScore)
+    return stmt.on_conflict_do_update(
+        index_elements=[TournamentScore.tournament_id, TournamentScore.user_id],
+        set_={
+            "score": TournamentScore.score + stmt.excluded.score,
+            "games": TournamentScore.games + stmt.excluded.games,
+            "username": stmt.excluded.username,
+        })
+
+
+class Tournaments:
+    # Таблица турнира в памяти, поверх сводной таблицы tournament_scores. Очки не пересчитываются
+    # по комнатам: каждое изменение (итоги раунда, правка хоста, конец игры) приходит приращением
+    # и пишется в сводную таблицу UPSERT'ом, а в память попадает только после коммита (apply).
+    # Каждое изменение поднимает tournaments.version. Если версия в памяти отстала (очки писал
+    # другой воркер), таблица перечитывается при следующем чтении.
+    def __init__(self):
+        self.boards = {}
+        self.versions = {}
+        self.lock = asyncio.Lock()
+        self.upsert = _upsert()
+
+    async def board(self, session, tournament_id):
+        version = await session.scalar(select(Tournament.version).where(Tournament.id == tournament_id))
+        if self.versions.get(tournament_id, -1) != version:
+            async with self.lock:
+                if self.versions.get(tournament_id, -1) != version:
+                    await self._load(session, tournament_id)
+        return self.boards[tournament_id]
+
+    async def _load(self, session, tournament_id):
+        # Версия и очки одним запросом, чтобы они были из одного снимка
+        rows = (await session.execute(
+            select(Tournament.version, TournamentScore.user_id, TournamentScore.username, TournamentScore.score,
+                   TournamentScore.games).outerjoin(TournamentScore, TournamentScore.tournament_id == Tournament.id)
+            .where(Tournament.id == tournament_id))).all()
+        self.boards[tournament_id] = Leaderboard(row[1:] for row in rows if row.user_id is not None)
+        self.versions[tournament_id] = rows[0].version if rows else 0
+
+    async def add_scores(self, session, tournament_id, changes):
+        # changes: [(user_id, имя, очки, игр), ...]; коммит — за вызывающим, вместе с его изменениями,
+        # после коммита — apply() с возвращённой версией
+        if not changes:
+            return None
+        await session.execute(self.upsert, [
+            {"tournament_id": tournament_id, "user_id": user_id, "username": username, "score": delta, "games": games}
+            for user_id, username, delta, games in changes
+        ])
+        return await session.scalar(
+            update(Tournament).where(Tournament.id == tournament_id).values(version=Tournament.version + 1)
+            .returning(Tournament.version).execution_options(synchronize_session=False))
+
+    def apply(self, tournament_id, version, changes):
+        # Своё изменение накатывается, только если оно следующее по версии; иначе между ними
+        # есть чужие, и таблица сбрасывается до перечитывания
+        current = self.versions.get(tournament_id)
+        if version is None or current is None or version <= current:
+            return
+        if version == current + 1:
+            board = self.boards[tournament_id]
+            for user_id, username, delta, games in changes:
+                board.apply(user_id, username, delta, games)
+            self.versions[tournament_id] = version
+        else:
+            del self.boards[tournament_id], self.versions[tournament_id]
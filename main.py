@@ -1,46 +1,184 @@
 import asyncio
-import random
-import string
+import io
+import logging
+from datetime import datetime, timezone
 from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.base import StorageKey
 from sqlalchemy import select, update, func, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload
-from config import BOT_TOKEN
-from database import init_db, async_session, Room, Player, Card
+from broadcast import Broadcaster
+from card_import import ALLOWED_EXTENSIONS, MAX_CARDS_PER_IMPORT, MAX_FILE_SIZE, import_cards, split_csv, split_text
+from config import (ANSWER_DEBOUNCE, BOT_TOKEN, BROADCAST_CHAT_RATE, BROADCAST_CONCURRENCY, BROADCAST_GLOBAL_RATE,
+                    DB_METRICS_LOG_INTERVAL, DELIVERY_MODE, EVENT_LOG_BATCH, EVENT_LOG_FLUSH_INTERVAL,
+                    EVENT_LOG_MAX_PENDING, FSM_STORAGE, GROUP_BOARD_DEBOUNCE, GROUP_BOARD_INTERVAL,
+                    HOST_PANEL_DEBOUNCE, LEADERBOARD_SIZE, METRICS_HOST, METRICS_PORT, PLAYER_CACHE_SIZE,
+                    PLAYER_CACHE_TTL, PROFILE_DIR, PROFILE_SAMPLE_RATE, ROOM_CODE_COOLDOWN,
+                    ROOM_CODE_GROWTH_THRESHOLD, ROOM_CODE_MAX_LENGTH, ROOM_IDLE_TTL, ROOM_STATE_BACKEND,
+                    ROOM_STATE_FLUSH_INTERVAL, ROOM_SWEEP_BATCH, ROOM_SWEEP_INTERVAL, ROUND_DURATION,
+                    ROUND_DURATION_MAX, ROUND_DURATION_MIN, SLOW_UPDATE_THRESHOLD, TELEGRAM_API_URL, WEBHOOK_HOST,
+                    WEBHOOK_MAX_IN_FLIGHT, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL)
+from answer_buffer import AnswerCoalescer
+from answers import SQL_INDEX_MIN_PLAYERS, load_answers, load_index
+from board import GroupBoards, escape_markdown
+from database import init_db, async_session, Room, Player, Card, RoundAnswer, Tournament
+from deck import build_deck, deck_key
+import events
+from events import EventLog, archive_game
+from host_panel import HostPanels
+from leaderboard import Tournaments
+from metrics import (ApiTimingMiddleware, QueryBudgetMiddleware, UpdateMetricsMiddleware, query_metrics,
+                     run_metrics_server, spawn)
+from packs import init_packs
+from resolver import Membership, PlayerResolver
+from room_codes import RoomCodeAllocator
+from room_state import build_room_state
+from round_prep import RoundPreparer
+from scheduler import RoundScheduler
+from matching import FUZZY, ROUND_STRICTNESS, canonical_answers
+from scoring import MAX_ANSWER_LENGTH, score_round
 from states import GameStates
+from sweeper import RoomSweeper
+from unit_of_work import DbSessionMiddleware, session_scope
+from storage import build_round_signals, build_storage
+from webhook import run_webhook
+
+bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+dp = Dispatcher(storage=build_storage(FSM_STORAGE))
+round_signals = build_round_signals(dp.storage)
+dp.update.outer_middleware(UpdateMetricsMiddleware(slow_threshold=SLOW_UPDATE_THRESHOLD, profile_dir=PROFILE_DIR,
+                                                   sample_rate=PROFILE_SAMPLE_RATE))
+dp.message.middleware(QueryBudgetMiddleware())
+dp.callback_query.middleware(QueryBudgetMiddleware())
+dp.message.middleware(DbSessionMiddleware())
+dp.callback_query.middleware(DbSessionMiddleware())
+bot.session.middleware(ApiTimingMiddleware())
+broadcaster = Broadcaster(bot, concurrency=BROADCAST_CONCURRENCY, global_rate=BROADCAST_GLOBAL_RATE,
+                          chat_rate=BROADCAST_CHAT_RATE)
+room_state = build_room_state(ROOM_STATE_BACKEND, async_session, ROOM_STATE_FLUSH_INTERVAL)
+room_codes = RoomCodeAllocator(max_length=ROOM_CODE_MAX_LENGTH, threshold=ROOM_CODE_GROWTH_THRESHOLD,
+                               cooldown=ROOM_CODE_COOLDOWN)
+player_cache = PlayerResolver(maxsize=PLAYER_CACHE_SIZE, ttl=PLAYER_CACHE_TTL)
+tournaments = Tournaments()
+event_log = EventLog(async_session, batch_size=EVENT_LOG_BATCH, flush_interval=EVENT_LOG_FLUSH_INTERVAL,
+                     max_pending=EVENT_LOG_MAX_PENDING)
+
+
+async def send_round_warning(room_code, round_number):
+    async with query_metrics.budget("send_round_warning"):
+        await room_state.flush(room_code)
 
-#{"ROOM_CODE": asyncio.Event}
-room_events = {}
-
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+        async with async_session() as session:
+            room = await session.get(Room, room_code)
+            if not room or room.status != "playing" or room.round_number != round_number:
+                return
 
-def generate_room_code():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
+            players = (await session.execute(select(Player).where(Player.room_code == room_code))).scalars().all()
 
+    waiting = [p for p in players if not p.is_ready]
+    names = ", ".join(escape_markdown(p.username) for p in waiting)
+    if group_boards.update(room_code, progress="⏳ **Осталось 5 секунд!** Ждём: " + names):
+        return
+    await broadcaster.broadcast([p.user_id for p in waiting], "⏳ **Осталось 5 секунд!** Поторопитесь!",
+                                parse_mode="Markdown")
 
-async def send_warning_task(room_code, delay=55):
-    try:
-        await asyncio.sleep(delay)
 
+async def close_round(room_code, round_number):
+    # Раунд закрывается ровно один раз, даже если таймер и «все готовы» сработали одновременно
+    # или комната запланирована сразу в нескольких воркерах
+    async with query_metrics.budget("close_round"):
         async with async_session() as session:
-            room = await session.get(Room, room_code)
-            if not room or room.status != "playing":
-                return
+            result = await session.execute(
+                update(Room).where(Room.code == room_code, Room.round_number == round_number,
+                                   Room.round_deadline != None).values(round_deadline=None))
+            await session.commit()
 
-            players = (await session.execute(select(Player).where(Player.room_code == room_code))).scalars().all()
-            for p in players:
-                if not p.is_ready:
-                    try:
-                        await bot.send_message(p.user_id, "⏳ **Осталось 5 секунд!** Поторопитесь!",
-                                               parse_mode="Markdown")
-                    except:
-                        pass
+        if result.rowcount == 1:
+            await calculate_results(room_code)
+
+
+def render_answers_status(answers):
+    kb = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="✅ Я всё (Готов)", callback_data="player_ready")]
+    ])
+    text = f"Принято: {len(answers)}/6.\n" + "\n".join(answers) + "\n\nЕсли не будете менять — жмите кнопку!"
+    return text, {"reply_markup": kb}
+
+
+async def reject_answers(user_id):
+    await FSMContext(dp.storage, StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)).clear()
+    await broadcaster.send(user_id, "Игра уже завершена, ответы не принимаются.")
+
+
+# Склейка ответов держит их в памяти воркера, поэтому с общим состоянием комнат ответы пишутся сразу
+answer_buffer = AnswerCoalescer(room_state, broadcaster, render=render_answers_status, on_rejected=reject_answers,
+                                window=ANSWER_DEBOUNCE if ROOM_STATE_BACKEND == "memory" else 0)
+
+
+async def on_scores_adjusted(room_code, deltas):
+    event_log.record(events.SCORES_ADJUSTED, room_code,
+                     changes=[{"player_id": player_id, "delta": delta} for player_id, delta in deltas.items()])
+
+    # Правка хоста в турнирной комнате — такое же приращение для общей таблицы
+    async with async_session() as session:
+        rows = (await session.execute(
+            select(Player.id, Player.user_id, Player.username, Room.tournament_id).join(
+                Room, Player.room_code == Room.code).where(Player.id.in_(deltas), Room.tournament_id != None))).all()
+        if rows:
+            changes = [(r.user_id, r.username, deltas[r.id], 0) for r in rows]
+            version = await tournaments.add_scores(session, rows[0].tournament_id, changes)
+            await session.commit()
+            tournaments.apply(rows[0].tournament_id, version, changes)
+
+
+async def on_board_undelivered(room_code, text):
+    # Табло в группе не обновилось — то, что должно было на нём появиться, игроки получают в личку
+    async with async_session() as session:
+        user_ids = (await session.execute(
+            select(Player.user_id).where(Player.room_code == room_code))).scalars().all()
+    await broadcaster.broadcast(user_ids, text, parse_mode="Markdown")
 
-    except asyncio.CancelledError:
-        pass
+
+host_panels = HostPanels(broadcaster, async_session, window=HOST_PANEL_DEBOUNCE, on_flushed=on_scores_adjusted)
+group_boards = GroupBoards(bot, broadcaster, async_session, window=GROUP_BOARD_DEBOUNCE, interval=GROUP_BOARD_INTERVAL,
+                           on_undelivered=on_board_undelivered)
+
+
+def lobby_board(room_code, count):
+    return f"👥 Игроков: {count}\nЧтобы войти, напишите боту в личные сообщения `/join {room_code}`"
+
+
+round_scheduler = RoundScheduler(on_warning=send_round_warning, on_close=close_round, warning_before=5)
+round_signals.subscribe(round_scheduler.close_now)
+
+
+async def release_swept_rooms(codes, user_ids):
+    swept = set(codes)
+    for code in codes:
+        round_scheduler.cancel(code)
+        room_state.drop(code)
+        answer_buffer.drop_room(code)
+        room_codes.release(code)
+        player_cache.forget_room(code)
+        host_panels.drop(code)
+        group_boards.drop(code)
+        round_prep.discard(code)
+        event_log.record(events.ROOM_SWEPT, code)
+
+    for user_id in set(user_ids):
+        context = FSMContext(dp.storage, StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id))
+        # Игрок мог уже перейти в другую комнату — его состояние не трогаем
+        if (await context.get_data()).get("room_code") in swept:
+            await context.clear()
+
+
+room_sweeper = RoomSweeper(async_session, ttl=ROOM_IDLE_TTL, batch_size=ROOM_SWEEP_BATCH,
+                           on_swept=release_swept_rooms)
 
 
 async def perform_stop_game(session, room, trigger_user_id):
@@ -49,28 +187,36 @@ async def perform_stop_game(session, room, trigger_user_id):
 
     room_code = room.code
 
-    if room_code in room_events:
-        room_events[room_code].set()
+    round_scheduler.cancel(room_code)
+    room_state.drop(room_code)
+    answer_buffer.drop_room(room_code)
+    player_cache.forget_room(room_code)
+    host_panels.drop(room_code)
+    round_prep.discard(room_code)
 
     players_to_notify = (await session.execute(select(Player).where(Player.room_code == room_code))).scalars().all()
 
     for p in players_to_notify:
-        try:
-            state_key = StorageKey(bot_id=bot.id, chat_id=p.user_id, user_id=p.user_id)
-            await FSMContext(dp.storage, state_key).clear()
-
-            if p.user_id == trigger_user_id:
-                continue
+        state_key = StorageKey(bot_id=bot.id, chat_id=p.user_id, user_id=p.user_id)
+        await FSMContext(dp.storage, state_key).clear()
 
-            await bot.send_message(p.user_id, "🛑 **Игра остановлена хостом.**\nКомната распущена, все данные очищены.", parse_mode="Markdown")
-        except:
-            pass
+    if group_boards.update(room_code, round="🛑 **Игра остановлена хостом.**", progress=""):
+        await group_boards.flush(room_code)
+        group_boards.drop(room_code)
+    else:
+        await broadcaster.broadcast([p.user_id for p in players_to_notify if p.user_id != trigger_user_id],
+                                    "🛑 **Игра остановлена хостом.**\nКомната распущена, все данные очищены.",
+                                    parse_mode="Markdown")
 
+    await archive_game(session, room, players_to_notify, stopped=True)
     await session.execute(delete(Card).where(Card.room_code == room_code))
+    await session.execute(delete(RoundAnswer).where(RoundAnswer.room_code == room_code))
 
     await session.delete(room)
 
     await session.commit()
+    room_codes.release(room_code)
+    event_log.record(events.GAME_STOPPED, room_code, user_id=trigger_user_id, round_number=room.round_number)
 
     return True
 
@@ -85,6 +231,20 @@ async def get_round_type(round_num):
         return "express", "🚄 ЭКСПРЕСС (6 категорий)"
 
 
+async def render_round_prompt(round_number, card_text):
+    r_type, r_name = await get_round_type(round_number)
+    if r_type == "express":
+        cats = card_text.split('|')
+        formatted_cats = "\n".join([f"{i + 1}. {escape_markdown(c)}" for i, c in enumerate(cats)])
+        return (
+            f"🚄 **ЭКСПРЕСС (Важен порядок!)**\nНапишите 6 ответов строго по порядку:\n\n{formatted_cats}\n\n👇 Отправьте 6 строк.")
+    return (
+        f"🔔 **Раунд {round_number}: {r_name}**\nТема: **{escape_markdown(card_text)}**\n\n👇 Напишите 6 ассоциаций (порядок не важен):")
+
+
+round_prep = RoundPreparer(async_session, round_type=get_round_type, render=render_round_prompt)
+
+
 @dp.message(Command("help"))
 async def help_command(message: types.Message):
     text = (
@@ -96,8 +256,14 @@ async def help_command(message: types.Message):
         "`/join КОД` — Присоединиться к комнате по коду (например: `/join A1B2`)\n\n"
         "**Управление (когда вы в комнате):**\n"
         "`/setname Имя` — Сменить свой ник в игре\n"
+        "`/timer Секунды` — Длительность раунда (только для Хоста, до старта игры)\n"
         "/leave — Покинуть текущую комнату\n"
-        "/stop — Остановить игру принудительно (только для Хоста)\n\n"
+        "`/tournament new Название` — Создать турнир из нескольких комнат\n"
+        "`/tournament Номер` — Засчитывать игру комнаты в турнир (только для Хоста, до старта)\n"
+        "`/leaderboard [Номер]` — Таблица турнира и ваше место\n"
+        "/bind — Вести табло игры в групповом чате (только для Хоста, отправить в группе до старта)\n"
+        "/stop — Остановить игру принудительно (только для Хоста)\n"
+        "/stats — Скорость работы бота (только для Хоста)\n\n"
         "ℹ️ *Если бот не отвечает на ваши сообщения во время раунда, значит, время вышло и идет подсчет очков.*"
     )
     await message.answer(text, parse_mode="Markdown")
@@ -130,29 +296,33 @@ async def rules_handler(message: types.Message):
 
 
 @dp.message(F.text == "Создать комнату")
-async def create_room(message: types.Message, state: FSMContext):
+async def create_room(message: types.Message, state: FSMContext, session: AsyncSession):
     user_id = message.from_user.id
 
-    async with async_session() as session:
-        stmt = select(Player).options(joinedload(Player.room)).where(Player.user_id == user_id)
-        existing_player = await session.scalar(stmt)
-
-        if existing_player and existing_player.room and existing_player.room.status in ["waiting", "playing"]:
-            return await message.answer(
-                "⛔ Вы уже находитесь в активной комнате!\n"
-                "Сначала выйдите из текущей игры, написав команду /leave."
-            )
-
-        code = generate_room_code()
-        room = Room(code=code, host_id=user_id)
+    # Законченные комнаты удаляются сразу, так что любая найденная комната — активная
+    if await player_cache.confirm(session, user_id):
+        return await message.answer(
+            "⛔ Вы уже находитесь в активной комнате!\n"
+            "Сначала выйдите из текущей игры, написав команду /leave."
+        )
 
-        user_name = message.from_user.full_name or message.from_user.first_name
+    user_name = message.from_user.full_name or message.from_user.first_name
 
+    for _ in range(3):
+        code = room_codes.allocate()
         player = Player(user_id=user_id, username=user_name, room_code=code)
-
-        session.add(room)
+        session.add(Room(code=code, host_id=user_id))
         session.add(player)
-        await session.commit()
+        try:
+            await session.commit()
+            player_cache.remember(user_id, Membership(player.id, code, True))
+            event_log.record(events.ROOM_CREATED, code, user_id=user_id, username=user_name)
+            break
+        except IntegrityError:
+            # Код уже занят комнатой другого воркера — в локальной карте он останется помеченным
+            await session.rollback()
+    else:
+        return await message.answer("Не удалось создать комнату, попробуйте ещё раз.")
 
     await state.set_state(GameStates.in_lobby)
     await state.update_data(room_code=code)
@@ -193,48 +363,48 @@ async def set_add_card_mode(callback: types.CallbackQuery, state: FSMContext):
             "📝 **Добавление обычных карт**\n"
             "Пришлите список тем одним сообщением.\n"
             "Разделяйте темы **запятой** или **новой строкой**.\n\n"
-            "Пример:\n`Любимые фильмы, Еда в столовой, Что подарить бабушке`"
+            "Пример:\n`Любимые фильмы, Еда в столовой, Что подарить бабушке`\n\n"
+            "Большой набор можно прислать файлом `.txt` или `.csv`."
         )
     else:
         text = (
             "📝 **Добавление карт для Экспресса**\n"
             "Пришлите темы. Каждая строка — это одна карточка, содержащая ровно **6 подтем**, разделенных знаком `|`.\n\n"
-            "Пример:\n`Зима|Лето|Осень|Весна|Дождь|Снег`\n`Москва|Питер|Казань|Сочи|Уфа|Омск`"
+            "Пример:\n`Зима|Лето|Осень|Весна|Дождь|Снег`\n`Москва|Питер|Казань|Сочи|Уфа|Омск`\n\n"
+            "Большой набор можно прислать файлом `.txt` или `.csv` (6 колонок в строке)."
         )
 
     await callback.message.edit_text(text, parse_mode="Markdown")
 
 
 @dp.message(GameStates.adding_cards)
-async def save_custom_cards(message: types.Message, state: FSMContext):
+async def save_custom_cards(message: types.Message, state: FSMContext, session: AsyncSession):
     data = await state.get_data()
     room_code = data.get("room_code")
     mode = data.get("adding_mode")
 
-    text = message.text
-    added_count = 0
+    if message.document:
+        file_name = (message.document.file_name or "").lower()
+        if not file_name.endswith(ALLOWED_EXTENSIONS):
+            return await message.answer("Поддерживаются только файлы `.txt` и `.csv`.", parse_mode="Markdown")
+        if message.document.file_size and message.document.file_size > MAX_FILE_SIZE:
+            return await message.answer(f"Файл слишком большой (максимум {MAX_FILE_SIZE // 1024} КБ).")
 
-    async with async_session() as session:
-        if mode == "standard":
-            raw_lines = text.replace(',', '\n').split('\n')
-            for line in raw_lines:
-                clean_text = line.strip()
-                if clean_text:
-                    card = Card(text=clean_text, is_blitz=False, room_code=room_code)
-                    session.add(card)
-                    added_count += 1
-
-        elif mode == "express":
-            lines = text.split('\n')
-            for line in lines:
-                parts = line.split('|')
-                if len(parts) >= 2:
-                    clean_text = line.strip()
-                    card = Card(text=clean_text, is_blitz=True, room_code=room_code)
-                    session.add(card)
-                    added_count += 1
+        buffer = await bot.download(message.document, destination=io.BytesIO())
+        try:
+            text = buffer.getvalue().decode("utf-8-sig")
+        except UnicodeDecodeError:
+            return await message.answer("Не удалось прочитать файл. Сохраните его в кодировке UTF-8.")
+        entries = split_csv(text, mode) if file_name.endswith(".csv") else split_text(text, mode)
+    elif message.text:
+        entries = split_text(message.text, mode)
+    else:
+        return await message.answer("Пришлите темы текстом или файлом `.txt`/`.csv`.", parse_mode="Markdown")
 
-        await session.commit()
+    result = await import_cards(session, room_code, entries, is_blitz=(mode == "express"))
+    await session.execute(
+        update(Room).where(Room.code == room_code).values(last_activity=datetime.now(timezone.utc)))
+    await session.commit()
 
     kb = types.InlineKeyboardMarkup(inline_keyboard=[
         [types.InlineKeyboardButton(text="Начать игру 🚀", callback_data="start_game")],
@@ -242,8 +412,16 @@ async def save_custom_cards(message: types.Message, state: FSMContext):
     ])
 
     await state.set_state(GameStates.in_lobby)
-    await message.answer(f"✅ Добавлено карточек: **{added_count}**.\nОни будут использованы в приоритете!",
-                         reply_markup=kb, parse_mode="Markdown")
+    text = f"✅ Добавлено карточек: **{result.added}**.\nОни будут использованы в приоритете!"
+    if result.duplicates:
+        text += f"\nПропущено повторов: {result.duplicates}"
+    if result.invalid:
+        text += f"\nПропущено некорректных: {result.invalid}"
+        if mode == "express":
+            text += " (нужно ровно 6 тем через `|`)"
+    if result.truncated:
+        text += f"\nЗа один раз можно добавить не больше {MAX_CARDS_PER_IMPORT} карточек, остальные не сохранены."
+    await message.answer(text, reply_markup=kb, parse_mode="Markdown")
 
 
 @dp.callback_query(F.data == "back_to_lobby")
@@ -255,25 +433,140 @@ async def back_lobby(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text("Готовы начать?", reply_markup=kb)
 
 @dp.message(Command("setname"))
-async def set_name_command(message: types.Message):
+async def set_name_command(message: types.Message, session: AsyncSession):
     args = message.text.split(maxsplit=1)
     if len(args) < 2:
         return await message.answer("Используйте: `/setname НовоеИмя`", parse_mode="Markdown")
 
     new_name = args[1].strip()[:20]
 
-    async with async_session() as session:
-        player = await session.scalar(select(Player).where(Player.user_id == message.from_user.id))
-        if player:
-            player.username = new_name
-            await session.commit()
-            await message.answer(f"✅ Ваше имя изменено на: **{new_name}**", parse_mode="Markdown")
-        else:
-            await message.answer("Сначала войдите в комнату с помощью /join")
+    membership = await player_cache.resolve(session, message.from_user.id)
+    if membership and (await session.execute(
+            update(Player).where(Player.id == membership.player_id).values(username=new_name))).rowcount:
+        await session.commit()
+        await message.answer(f"✅ Ваше имя изменено на: **{new_name}**", parse_mode="Markdown")
+    else:
+        player_cache.forget(message.from_user.id)
+        await message.answer("Сначала войдите в комнату с помощью /join")
+
+
+@dp.message(Command("timer"))
+async def set_timer_command(message: types.Message, session: AsyncSession):
+    args = message.text.split()
+    if len(args) < 2 or not args[1].isdigit():
+        return await message.answer("Используйте: `/timer 90`", parse_mode="Markdown")
+
+    duration = int(args[1])
+    if not ROUND_DURATION_MIN <= duration <= ROUND_DURATION_MAX:
+        return await message.answer(f"Длительность раунда — от {ROUND_DURATION_MIN} до {ROUND_DURATION_MAX} секунд.")
+
+    membership = await player_cache.resolve(session, message.from_user.id)
+    room = membership and membership.is_host and await session.get(Room, membership.room_code)
+
+    if not room:
+        return await message.answer("Только хост может менять длительность раунда.")
+    if room.status != "waiting":
+        return await message.answer("Длительность можно менять только до старта игры.")
+
+    room.round_duration = duration
+    room.last_activity = datetime.now(timezone.utc)
+    await session.commit()
+
+    await message.answer(f"⏱ Длительность раунда: **{duration} сек.**", parse_mode="Markdown")
+
+
+@dp.message(Command("stats"))
+async def stats_command(message: types.Message, session: AsyncSession):
+    membership = await player_cache.resolve(session, message.from_user.id)
+    if not membership or not membership.is_host:
+        return await message.answer("Статистика доступна только хосту комнаты.")
+
+    text = query_metrics.update_summary() or "Пока нет данных."
+    pool = query_metrics.pool_status()
+    if pool:
+        text += f"\n\nПул БД: занято {pool['checked_out']} из {pool['size']} (+{pool['overflow']})"
+    await message.answer("📈 Время обработки апдейтов (p50 / p95 / p99):\n\n" + text)
+
+
+@dp.message(Command("bind"))
+async def bind_group_command(message: types.Message, session: AsyncSession):
+    if message.chat.type not in ("group", "supergroup"):
+        return await message.answer("Отправьте /bind в групповом чате, где будет идти игра.")
+
+    membership = await player_cache.resolve(session, message.from_user.id)
+    room = membership and membership.is_host and await session.get(Room, membership.room_code)
+    if not room:
+        return await message.answer("Привязать комнату к группе может только её хост.")
+    if room.status != "waiting":
+        return await message.answer("Привязать комнату можно только до старта игры.")
+
+    count = await session.scalar(select(func.count(Player.id)).where(Player.room_code == room.code))
+    room.last_activity = datetime.now(timezone.utc)
+    if not await group_boards.attach(session, room, message.chat.id, progress=lobby_board(room.code, count)):
+        await message.answer("Не удалось отправить табло в этот чат.")
+
+
+@dp.message(Command("tournament"))
+async def tournament_command(message: types.Message, session: AsyncSession):
+    args = message.text.split(maxsplit=2)
+    if len(args) >= 3 and args[1].lower() == "new":
+        tournament = Tournament(name=args[2].strip()[:64], owner_id=message.from_user.id)
+        session.add(tournament)
+        await session.commit()
+        return await message.answer(
+            f"🏆 Турнир **{tournament.name}** создан, номер: `{tournament.id}`.\n"
+            f"Хосты комнат подключают к нему игру командой `/tournament {tournament.id}` до старта.",
+            parse_mode="Markdown")
+    if len(args) != 2 or not args[1].isdigit():
+        return await message.answer("Используйте: `/tournament new Название` или `/tournament Номер`",
+                                    parse_mode="Markdown")
+
+    tournament = await session.get(Tournament, int(args[1]))
+    if not tournament:
+        return await message.answer("Турнир не найден.")
+    membership = await player_cache.resolve(session, message.from_user.id)
+    room = membership and membership.is_host and await session.get(Room, membership.room_code)
+    if not room:
+        return await message.answer("Подключить комнату к турниру может только её хост.")
+    if room.status != "waiting":
+        return await message.answer("Подключить комнату можно только до старта игры.")
+
+    room.tournament_id = tournament.id
+    room.last_activity = datetime.now(timezone.utc)
+    await session.commit()
+    await message.answer(f"✅ Очки этой игры пойдут в турнир **{tournament.name}**.", parse_mode="Markdown")
+
+
+@dp.message(Command("leaderboard"))
+async def leaderboard_command(message: types.Message, session: AsyncSession):
+    args = message.text.split()
+    if len(args) > 1 and args[1].isdigit():
+        tournament_id = int(args[1])
+    else:
+        membership = await player_cache.resolve(session, message.from_user.id)
+        tournament_id = membership and await session.scalar(
+            select(Room.tournament_id).where(Room.code == membership.room_code))
+    tournament = tournament_id and await session.get(Tournament, tournament_id)
+    if not tournament:
+        return await message.answer("Укажите номер турнира: `/leaderboard Номер`", parse_mode="Markdown")
+
+    board = await tournaments.board(session, tournament.id)
+    if not len(board):
+        return await message.answer(f"🏆 **{tournament.name}**: очков пока нет.", parse_mode="Markdown")
+
+    text = f"🏆 **{tournament.name}** — игроков: {len(board)}\n\n"
+    top = board.top(LEADERBOARD_SIZE)
+    for place, user_id, username, score, games in top:
+        text += f"{place}. {username} — {score} (игр: {games})\n"
+    mine = board.place(message.from_user.id)
+    if mine and message.from_user.id not in {row[1] for row in top}:
+        place, score, games = mine
+        text += f"\nВаше место: {place} — {score} (игр: {games})"
+    await message.answer(text, parse_mode="Markdown")
 
 
 @dp.message(Command("join"))
-async def join_room(message: types.Message, state: FSMContext):
+async def join_room(message: types.Message, state: FSMContext, session: AsyncSession):
     args = message.text.split()
     if len(args) < 2:
         return await message.answer("Используйте: /join КОД")
@@ -281,29 +574,31 @@ async def join_room(message: types.Message, state: FSMContext):
 
     user_name = message.from_user.full_name or message.from_user.first_name
 
-    async with async_session() as session:
-        room = await session.get(Room, code)
-        if not room or room.status != "waiting":
-            return await message.answer("Комната недоступна.")
-
-        existing = await session.scalar(
-            select(Player).where(Player.user_id == message.from_user.id, Player.room_code == code))
+    room = await session.get(Room, code)
+    if not room or room.status != "waiting":
+        return await message.answer("Комната недоступна.")
 
-        if not existing:
-            player = Player(user_id=message.from_user.id, username=user_name, room_code=code)
-            session.add(player)
-            await session.commit()
+    existing = await session.scalar(
+        select(Player).where(Player.user_id == message.from_user.id, Player.room_code == code))
 
-            count = await session.scalar(select(func.count(Player.id)).where(Player.room_code == code))
-            try:
-                await bot.send_message(
-                    room.host_id,
-                    f"👤 **Новый игрок!**\nК нам присоединился: {user_name}\nВсего игроков: {count}"
-                )
-            except:
-                pass
-        else:
-            await message.answer("Вы уже в этой комнате.")
+    if not existing:
+        player = Player(user_id=message.from_user.id, username=user_name, room_code=code)
+        session.add(player)
+        room.last_activity = datetime.now(timezone.utc)
+        await session.flush()
+        count = await session.scalar(select(func.count(Player.id)).where(Player.room_code == code))
+        await session.commit()
+        is_host = room.host_id == message.from_user.id
+        player_cache.remember(message.from_user.id, Membership(player.id, code, is_host))
+        event_log.record(events.PLAYER_JOINED, code, user_id=message.from_user.id, username=user_name)
+
+        if not group_boards.update(code, progress=lobby_board(code, count)):
+            await broadcaster.send(
+                room.host_id,
+                f"👤 **Новый игрок!**\nК нам присоединился: {user_name}\nВсего игроков: {count}"
+            )
+    else:
+        await message.answer("Вы уже в этой комнате.")
 
     await state.set_state(GameStates.in_lobby)
     await state.update_data(room_code=code)
@@ -317,138 +612,120 @@ async def ask_custom_card(callback: types.CallbackQuery, state: FSMContext):
 
 
 @dp.callback_query(F.data == "start_game")
-async def start_game_handler(callback: types.CallbackQuery, state: FSMContext):
+async def start_game_handler(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     data = await state.get_data()
     code = data.get("room_code")
 
-    async with async_session() as session:
-        await session.execute(update(Room).where(Room.code == code).values(status="playing", round_number=0))
-        await session.commit()
+    rounds = {}
+    for round_num in range(1, 7):
+        r_type, _ = await get_round_type(round_num)
+        key = deck_key(r_type == "express")
+        rounds[key] = rounds.get(key, 0) + 1
 
-    await start_next_round(code)
+    deck = await build_deck(session, code, rounds)
+    await session.execute(
+        update(Room).where(Room.code == code).values(status="playing", round_number=0, deck=deck,
+                                                  last_activity=datetime.now(timezone.utc)))
 
+    await start_next_round(code, session)
 
-@dp.message(Command("stop"))
-async def stop_game_command(message: types.Message):
-    async with async_session() as session:
-        stmt = select(Player).options(joinedload(Player.room)).where(Player.user_id == message.from_user.id)
-        player = await session.scalar(stmt)
-
-        if not player or not player.room:
-            return await message.answer("Вы не в игре.")
 
-        room = player.room
-        if room.host_id != message.from_user.id:
-            return await message.answer("Только хост может остановить игру.")
-
-        if await perform_stop_game(session, room, message.from_user.id):
-            await message.answer("✅ Игра остановлена.")
-        else:
-            await message.answer("Игра уже завершена.")
+@dp.message(Command("stop"))
+async def stop_game_command(message: types.Message, session: AsyncSession):
+    membership = await player_cache.resolve(session, message.from_user.id)
+    if not membership:
+        return await message.answer("Вы не в игре.")
+    if not membership.is_host:
+        return await message.answer("Только хост может остановить игру.")
+
+    room = await session.get(Room, membership.room_code)
+    if await perform_stop_game(session, room, message.from_user.id):
+        await message.answer("✅ Игра остановлена.")
+    else:
+        player_cache.forget(message.from_user.id)
+        await message.answer("Игра уже завершена.")
 
 
 @dp.message(Command("leave"))
-async def leave_room_command(message: types.Message, state: FSMContext):
+async def leave_room_command(message: types.Message, state: FSMContext, session: AsyncSession):
     user_id = message.from_user.id
-    async with async_session() as session:
-        stmt = select(Player).options(joinedload(Player.room)).where(Player.user_id == user_id)
-        player = await session.scalar(stmt)
+    membership = await player_cache.resolve(session, user_id)
+    player = membership and await session.get(Player, membership.player_id, options=[joinedload(Player.room)])
+    player_cache.forget(user_id)
 
-        if not player or not player.room:
-            await state.clear()
-            return await message.answer("Вы не находитесь в активной комнате.")
+    if not player or not player.room:
+        await state.clear()
+        return await message.answer("Вы не находитесь в активной комнате.")
 
-        room = player.room
-        room_code = room.code
-        is_host = (room.host_id == user_id)
+    room = player.room
+    room_code = room.code
+    is_host = (room.host_id == user_id)
 
-        if is_host and room.status != "finished":
-            await perform_stop_game(session, room, user_id)
-            await message.answer("Вы покинули комнату. Так как вы были хостом, игра остановлена для всех.")
-            await session.delete(player)
-            await session.commit()
+    if is_host and room.status != "finished":
+        await perform_stop_game(session, room, user_id)
+        await message.answer("Вы покинули комнату. Так как вы были хостом, игра остановлена для всех.")
+        await session.delete(player)
+        await session.commit()
 
-        else:
-            username = player.username
-            await session.delete(player)
-            await session.commit()
+    else:
+        username = player.username
+        room_state.remove_player(user_id)
+        await session.delete(player)
+        await session.flush()
+        count = await session.scalar(select(func.count(Player.id)).where(Player.room_code == room_code))
+        await session.commit()
+        event_log.record(events.PLAYER_LEFT, room_code, user_id=user_id, round_number=room.round_number)
 
-            await message.answer(f"Вы покинули комнату {room_code}.")
+        await message.answer(f"Вы покинули комнату {room_code}.")
 
-            if room.status != "finished":
-                count = await session.scalar(select(func.count(Player.id)).where(Player.room_code == room_code))
-                try:
-                    await bot.send_message(room.host_id, f"🏃‍♂️ Игрок **{username}** покинул игру. Осталось: {count}",
-                                           parse_mode="Markdown")
-                except:
-                    pass
+        if room.status == "waiting" and room_code in group_boards:
+            group_boards.update(room_code, progress=lobby_board(room_code, count))
+        elif room.status != "finished":
+            await broadcaster.send(room.host_id, f"🏃‍♂️ Игрок **{username}** покинул игру. Осталось: {count}",
+                                   parse_mode="Markdown")
 
     await state.clear()
 
 
-async def start_next_round(room_code):
-    round_event = asyncio.Event()
-    room_events[room_code] = round_event
-
-    async with async_session() as session:
-        room = await session.get(Room, room_code)
-        if not room or room.status == "finished": return
+async def start_next_round(room_code, session=None):
+    # Обычно раунд уже подготовлен, пока хост проверял очки, — остаётся записать его и разослать
+    prepared = await round_prep.take(room_code)
+    # Несохранённое состояние прошлого раунда пишется своей сессией — до того, как эта возьмёт блокировку
+    await room_state.release(room_code)
+    async with session_scope(session) as session:
+        deadline = prepared and await round_prep.claim(session, prepared)
+        if not deadline:
+            room = await session.get(Room, room_code)
+            if not room or room.status == "finished": return
+            if room.round_number >= 6:
+                players = (await session.execute(select(Player).where(Player.room_code == room_code))).scalars().all()
+                return await finish_game(session, room, players)
 
-        room.round_number += 1
-        if room.round_number > 6: return await finish_game(room_code, session)
+            prepared = await round_prep.prepare(session, room_code, room.round_number + 1, room.deck,
+                                                room.round_duration or ROUND_DURATION)
+            deadline = await round_prep.claim(session, prepared)
+            if not deadline: return
 
-        r_type, r_name = await get_round_type(room.round_number)
-        need_blitz = (r_type == "express")
-        stmt_custom = select(Card).where(Card.is_blitz == need_blitz, Card.room_code == room_code)
-        custom_cards = (await session.execute(stmt_custom)).scalars().all()
-        if custom_cards:
-            card = random.choice(custom_cards)
-        else:
-            stmt_default = select(Card).where(Card.is_blitz == need_blitz, Card.room_code == None)
-            default_cards = (await session.execute(stmt_default)).scalars().all()
-            card = random.choice(default_cards) if default_cards else Card(text="Резерв", is_blitz=False)
-
-        room.current_card_text = card.text
-        await session.execute(
-            update(Player).where(Player.room_code == room_code).values(current_answers=None, is_ready=False))
+        # Состав берётся из самого сброса готовности, поэтому вошедшие и вышедшие игроки учтены
+        players = (await session.execute(
+            update(Player).where(Player.room_code == room_code).values(is_ready=False).returning(
+                Player.id, Player.user_id, Player.is_ready).execution_options(synchronize_session=False))).all()
         await session.commit()
-        players = (await session.execute(select(Player).where(Player.room_code == room_code))).scalars().all()
+        room_state.load(room_code, prepared.round_number, players)
+        answer_buffer.reset([p.user_id for p in players])
+        event_log.record(events.ROUND_STARTED, room_code, round_number=prepared.round_number,
+                         card=prepared.card_text, players=len(players))
 
+    round_scheduler.schedule(room_code, prepared.round_number, deadline.timestamp())
+    # Состояние ставится до рассылки, чтобы не потерять ответ, пришедший сразу после задания
     for p in players:
-        if r_type == "express":
-            cats = card.text.split('|')
-            formatted_cats = "\n".join([f"{i + 1}. {c}" for i, c in enumerate(cats)])
-            msg = (
-                f"🚄 **ЭКСПРЕСС (Важен порядок!)**\nНапишите 6 ответов строго по порядку:\n\n{formatted_cats}\n\n👇 Отправьте 6 строк.")
-        else:
-            msg = (
-                f"🔔 **Раунд {room.round_number}: {r_name}**\nТема: **{card.text}**\n\n👇 Напишите 6 ассоциаций (порядок не важен):")
-
-        try:
-            await bot.send_message(p.user_id, msg, parse_mode="Markdown")
-            state_key = StorageKey(bot_id=bot.id, chat_id=p.user_id, user_id=p.user_id)
-            await FSMContext(dp.storage, state_key).set_state(GameStates.writing_answers)
-        except:
-            pass
-
-    warning_task = asyncio.create_task(send_warning_task(room_code, delay=55))
-
-    try:
-          await asyncio.wait_for(round_event.wait(), timeout=60.0)
-    except asyncio.TimeoutError:
-        pass
-    finally:
-        if not warning_task.done():
-            warning_task.cancel()
-
-    if room_code in room_events:
-        del room_events[room_code]
-
-    async with async_session() as session:
-        room = await session.get(Room, room_code)
-        if not room or room.status == "finished": return
+        state_key = StorageKey(bot_id=bot.id, chat_id=p.user_id, user_id=p.user_id)
+        await FSMContext(dp.storage, state_key).set_state(GameStates.writing_answers)
 
-    await calculate_results(room_code)
+    # В групповом режиме задание висит на табло, а ответы игроки пишут боту в личку
+    board_prompt = prepared.prompt + "\n\n✍️ Ответы отправляйте боту в личные сообщения."
+    if not group_boards.update(room_code, round=board_prompt, progress=f"✅ Готовы: 0/{len(players)}"):
+        await broadcaster.broadcast([p.user_id for p in players], prepared.prompt, parse_mode="Markdown")
 
 
 @dp.message(GameStates.in_lobby)
@@ -461,126 +738,73 @@ async def lobby_chat(message: types.Message):
 @dp.message(GameStates.writing_answers)
 async def receive_answer(message: types.Message, state: FSMContext):
     text = message.text.replace(',', '\n').replace(';', '\n')
-    answers = [line.strip() for line in text.split('\n') if line.strip()][:6]
+    answers = [line.strip()[:MAX_ANSWER_LENGTH] for line in text.split('\n') if line.strip()][:6]
     if not answers: return
 
-    async with async_session() as session:
-        stmt = select(Player, Room).join(Room, Player.room_code == Room.code).where(
-            Player.user_id == message.from_user.id)
-        result = (await session.execute(stmt)).first()
-
-        if not result:
-            await state.clear()
-            return
-
-        player, room = result
-
-        if room.status != "playing":
-            await state.clear()
-            await message.answer("Игра уже завершена, ответы не принимаются.")
-            return
-
-        player.current_answers = "||".join(answers)
-        await session.execute(update(Player).where(Player.id == player.id).values(current_answers="||".join(answers)))
-        await session.commit()
-
-    kb = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="✅ Я всё (Готов)", callback_data="player_ready")]
-    ])
-    await message.answer(
-        f"Принято: {len(answers)}/6.\n" + "\n".join(answers) + "\n\nЕсли не будете менять — жмите кнопку!",
-        reply_markup=kb
-    )
+    # Сохранение и ответ «Принято N/6» откладываются, пока игрок дописывает ответы
+    await answer_buffer.submit(message.from_user.id, answers, (await state.get_data()).get("room_code"))
 
 
 @dp.callback_query(F.data == "player_ready")
 async def player_ready_handler(callback: types.CallbackQuery):
     user_id = callback.from_user.id
 
-    async with async_session() as session:
-        await session.execute(update(Player).where(Player.user_id == user_id).values(is_ready=True))
-        await session.commit()
+    result = await answer_buffer.flush(user_id) and await room_state.mark_ready(user_id)
+    if not result:
+        return await callback.answer("Раунд уже завершен.")
 
-        player = (await session.execute(select(Player).where(Player.user_id == user_id))).scalars().first()
-        room_code = player.room_code
-
-        total_players = await session.execute(select(func.count(Player.id)).where(Player.room_code == room_code))
-        ready_players = await session.execute(
-            select(func.count(Player.id)).where(Player.room_code == room_code, Player.is_ready == True))
-
-        total = total_players.scalar()
-        ready = ready_players.scalar()
+    ready, total = result.ready, result.total
 
     await callback.answer(f"Готово! Ждем остальных ({ready}/{total})")
+    group_boards.update(result.room_code, progress=f"✅ Готовы: {ready}/{total}")
     await callback.message.edit_text(f"✅ Вы отметились как готовый. Ждем остальных ({ready}/{total})...")
 
-    if ready == total:
-        if room_code in room_events:
-            room_events[room_code].set()
+    if result.completed:
+        await round_signals.publish(result.room_code)
 
 
 
 async def calculate_results(room_code):
+    await answer_buffer.flush_room(room_code)
+    await room_state.release(room_code)
+
     async with async_session() as session:
         room = await session.get(Room, room_code)
         players = (await session.execute(select(Player).where(Player.room_code == room_code))).scalars().all()
 
         r_type, _ = await get_round_type(room.round_number)
 
-        player_answers_map = {}
-        for p in players:
-            if p.current_answers:
-                player_answers_map[p.id] = [a.lower().strip() for a in p.current_answers.split('||')]
-            else:
-                player_answers_map[p.id] = []
+        answers = await load_answers(session, room_code, room.round_number)
+        player_answers_map = {p.id: answers.get(p.id, []) for p in players}
 
-        round_scores = {}
+        strictness = ROUND_STRICTNESS[r_type]
+        index = None
+        if strictness != FUZZY and len(players) >= SQL_INDEX_MIN_PLAYERS:
+            # Нормализованная и основная формы уже лежат в БД, поэтому совпадения можно посчитать GROUP BY;
+            # группы опечаток складываются только в Python
+            index = await load_index(session, room_code, room.round_number, r_type, strictness)
+        round_scores = score_round(r_type, canonical_answers(player_answers_map, strictness), index)
 
         for p in players:
-            added_score = 0
-            p_answers = player_answers_map.get(p.id, [])
-            matches_count = 0
-
-            for i, my_ans in enumerate(p_answers):
-                is_match_found = False
-
-                for other in players:
-                    if other.id == p.id: continue
-
-                    other_answers = player_answers_map.get(other.id, [])
-
-                    if r_type == "express":
-                        if i < len(other_answers) and other_answers[i] == my_ans:
-                            is_match_found = True
-                            break
-
-                    else:
-                        if my_ans in other_answers:
-                            is_match_found = True
-                            break
-
-                if r_type in ["sync", "express"]:
-                    if is_match_found:
-                        added_score += 1
-                        matches_count += 1
-
-                elif r_type == "diff":
-                    if not is_match_found:
-                        added_score += 1
-                        matches_count += 1
-
-            if len(p_answers) == 6 and matches_count == 6:
-                added_score += 1
-
-            round_scores[p.id] = added_score
-            p.score += added_score
+            p.score += round_scores[p.id]
+        room.last_activity = datetime.now(timezone.utc)
+        tournament_changes = [(p.user_id, p.username, round_scores[p.id], 0) for p in players]
+        version = room.tournament_id and await tournaments.add_scores(session, room.tournament_id, tournament_changes)
 
         await session.commit()
+        if version:
+            tournaments.apply(room.tournament_id, version, tournament_changes)
+        for p in players:
+            event_log.record(events.ANSWERS_SUBMITTED, room_code, user_id=p.user_id, round_number=room.round_number,
+                             answers=player_answers_map[p.id], points=round_scores[p.id])
+        if room.round_number < 6:
+            # Пока хост проверяет очки, следующий раунд готовится в фоне
+            round_prep.schedule(room)
 
         summary_text = f"📊 **Итоги раунда {room.round_number}**\n\n"
 
         for p in players:
-            ans_list = player_answers_map.get(p.id, [])
+            ans_list = [escape_markdown(answer) for answer in player_answers_map.get(p.id, [])]
 
             if r_type == "express":
                 ans_display = "\n".join([f"{k + 1}. {word}" for k, word in enumerate(ans_list)])
@@ -588,7 +812,8 @@ async def calculate_results(room_code):
             else:
                 display_block = ", ".join(ans_list)
 
-            summary_text += f"👤 **{p.username}**: +{round_scores[p.id]} ⭐️\nОтветы: {display_block}\n\n"
+            summary_text += (f"👤 **{escape_markdown(p.username)}**: +{round_scores[p.id]} ⭐️\n"
+                             f"Ответы: {display_block}\n\n")
 
         summary_text += "Администратор проверяет результаты..."
 
@@ -597,131 +822,93 @@ async def calculate_results(room_code):
         state_key = StorageKey(bot_id=bot.id, chat_id=p.user_id, user_id=p.user_id)
         await FSMContext(dp.storage, state_key).set_state(GameStates.scoring)
 
-        if p.user_id == host_id:
-            await send_host_panel(p.user_id, room_code, summary_text)
-        else:
-            await bot.send_message(p.user_id, summary_text, parse_mode="Markdown")
-
+    deliveries = [host_panels.show(host_id, room_code, summary_text, players)]
+    if not group_boards.update(room_code, round=summary_text, progress=""):
+        deliveries.append(broadcaster.broadcast([p.user_id for p in players if p.user_id != host_id], summary_text,
+                                                parse_mode="Markdown"))
+    await asyncio.gather(*deliveries)
 
-async def send_host_panel(chat_id, room_code, summary_text):
-    async with async_session() as session:
-        players = (await session.execute(
-            select(Player).where(Player.room_code == room_code).order_by(Player.id))).scalars().all()
-
-    keyboard = []
-    for p in players:
-        btn_text = f"✏️ {p.username} ({p.score})"
-        keyboard.append([types.InlineKeyboardButton(text=btn_text, callback_data=f"edit_score_{p.id}_{room_code}")])
-
-    keyboard.append([types.InlineKeyboardButton(text="➡️ Следующий раунд", callback_data=f"host_next_{room_code}")])
-
-    kb = types.InlineKeyboardMarkup(inline_keyboard=keyboard)
-
-    await bot.send_message(
-        chat_id,
-        summary_text + "\n\n👮‍♂️ **Панель Хоста**:\nНажмите на игрока, чтобы исправить очки, если робот ошибся.",
-        reply_markup=kb,
-        parse_mode="Markdown"
-    )
 
+async def is_room_host(session, user_id, room_code):
+    membership = await player_cache.resolve(session, user_id)
+    return membership is not None and membership.is_host and membership.room_code == room_code
 
 
 @dp.callback_query(F.data.startswith("edit_score_"))
-async def edit_score_menu(callback: types.CallbackQuery):
+async def edit_score_menu(callback: types.CallbackQuery, session: AsyncSession):
     # data format: edit_score_PLAYERID_ROOMCODE
     _, _, player_id_str, room_code = callback.data.split("_")
-    player_id = int(player_id_str)
 
-    async with async_session() as session:
-        host_player = await session.scalar(select(Player).where(Player.user_id == callback.from_user.id))
-        room = await session.get(Room, room_code)
+    if not await is_room_host(session, callback.from_user.id, room_code):
+        return await callback.answer("Вы не хост!", show_alert=True)
 
-        if not host_player or not room or room.host_id != callback.from_user.id:
-            return await callback.answer("Вы не хост!", show_alert=True)
-
-        target_player = await session.get(Player, player_id)
-        if not target_player:
-            return await callback.answer("Игрок не найден")
-
-        current_score = target_player.score
-        name = target_player.username
-
-    kb = types.InlineKeyboardMarkup(inline_keyboard=[
-        [
-            types.InlineKeyboardButton(text="➖ 1", callback_data=f"mod_score_-1_{player_id}_{room_code}"),
-            types.InlineKeyboardButton(text=f"🏆 {current_score}", callback_data="noop"),
-            types.InlineKeyboardButton(text="➕ 1", callback_data=f"mod_score_+1_{player_id}_{room_code}")
-        ],
-        [types.InlineKeyboardButton(text="🔙 Назад к списку", callback_data=f"back_panel_{room_code}")]
-    ])
-
-    await callback.message.edit_text(f"Редактирование очков игрока **{name}**:", reply_markup=kb, parse_mode="Markdown")
+    if await host_panels.edit_player(session, room_code, callback.message, int(player_id_str)) is None:
+        return await callback.answer("Игрок не найден")
+    await callback.answer()
 
 
 @dp.callback_query(F.data.startswith("mod_score_"))
-async def modify_score_handler(callback: types.CallbackQuery):
+async def modify_score_handler(callback: types.CallbackQuery, session: AsyncSession):
     # data format: mod_score_DELTA_PLAYERID_ROOMCODE
     parts = callback.data.split("_")
     delta = int(parts[2])
     player_id = int(parts[3])
     room_code = parts[4]
 
-    async with async_session() as session:
-        player = await session.get(Player, player_id)
-        if player:
-            player.score += delta
-            new_score = player.score
-            name = player.username
-            await session.commit()
+    if not await is_room_host(session, callback.from_user.id, room_code):
+        return await callback.answer("Вы не хост!", show_alert=True)
 
-    kb = types.InlineKeyboardMarkup(inline_keyboard=[
-        [
-            types.InlineKeyboardButton(text="➖ 1", callback_data=f"mod_score_-1_{player_id}_{room_code}"),
-            types.InlineKeyboardButton(text=f"🏆 {new_score}", callback_data="noop"),
-            types.InlineKeyboardButton(text="➕ 1", callback_data=f"mod_score_+1_{player_id}_{room_code}")
-        ],
-        [types.InlineKeyboardButton(text="🔙 Назад к списку", callback_data=f"back_panel_{room_code}")]
-    ])
-
-    try:
-        await callback.message.edit_text(f"Редактирование очков игрока **{name}**:", reply_markup=kb,
-                                         parse_mode="Markdown")
-    except:
-        pass
+    # Очки запишутся и панель перерисуется, когда хост перестанет нажимать
+    result = await host_panels.adjust(session, room_code, callback.message, player_id, delta)
+    if result is None:
+        return await callback.answer("Игрок не найден")
+    name, score = result
+    await callback.answer(f"{name}: {score}")
 
 
 @dp.callback_query(F.data.startswith("back_panel_"))
-async def back_to_panel(callback: types.CallbackQuery):
+async def back_to_panel(callback: types.CallbackQuery, session: AsyncSession):
     room_code = callback.data.split("_")[-1]
-    await send_host_panel(callback.from_user.id, room_code, "📊 **Панель управления** (обновлено)")
+    if not await is_room_host(session, callback.from_user.id, room_code):
+        return await callback.answer("Вы не хост!", show_alert=True)
+    state = await host_panels.open(session, room_code, callback.message)
+    await host_panels.show_page(session, room_code, callback.message, state.page)
+    await callback.answer()
+
 
+@dp.callback_query(F.data.startswith("panel_page_"))
+async def panel_page(callback: types.CallbackQuery, session: AsyncSession):
+    # data format: panel_page_PAGE_ROOMCODE
+    _, _, page, room_code = callback.data.split("_")
+    if not await is_room_host(session, callback.from_user.id, room_code):
+        return await callback.answer("Вы не хост!", show_alert=True)
+    await host_panels.show_page(session, room_code, callback.message, int(page))
+    await callback.answer()
 
 
 @dp.callback_query(F.data.startswith("host_next_"))
-async def host_next_round(callback: types.CallbackQuery):
+async def host_next_round(callback: types.CallbackQuery, session: AsyncSession):
     room_code = callback.data.split("_")[-1]
+    room = await session.get(Room, room_code)
+    if not room or room.host_id != callback.from_user.id:
+        return await callback.answer("Только хост может продолжить игру!", show_alert=True)
+    # Правки очков, которые ещё ждут записи, должны попасть в общий счёт
+    await host_panels.flush(room_code)
+    host_panels.drop(room_code)
 
-    async with async_session() as session:
-        room = await session.get(Room, room_code)
-        if not room or room.host_id != callback.from_user.id:
-            return await callback.answer("Только хост может продолжить игру!", show_alert=True)
-
-        players = (await session.execute(select(Player).where(Player.room_code == room_code))).scalars().all()
+    players = (await session.execute(select(Player).where(Player.room_code == room_code))).scalars().all()
 
-        msg = f"✅ **Результаты раунда {room.round_number} утверждены!**\nОбщий счет:\n"
-        sorted_players = sorted(players, key=lambda x: x.score, reverse=True)
-        for p in sorted_players:
-            msg += f"{p.username}: {p.score}\n"
+    msg = f"✅ **Результаты раунда {room.round_number} утверждены!**\nОбщий счет:\n"
+    sorted_players = sorted(players, key=lambda x: x.score, reverse=True)
+    for p in sorted_players:
+        msg += f"{escape_markdown(p.username)}: {p.score}\n"
 
-    for p in players:
-        try:
-            await bot.send_message(p.user_id, msg, parse_mode="Markdown")
-        except:
-            pass
+    if not group_boards.update(room_code, leaderboard=msg):
+        await broadcaster.broadcast([p.user_id for p in players], msg, parse_mode="Markdown")
 
     await callback.message.edit_text("✅ Результаты сохранены. Запускаем следующий раунд...")
 
-    asyncio.create_task(start_next_round(room_code))
+    spawn("start_next_round", start_next_round(room_code))
 
 
 @dp.callback_query(F.data.startswith("next_round_"))
@@ -732,40 +919,48 @@ async def next_round_trigger(callback: types.CallbackQuery):
     await start_next_round(room_code)
 
 
-async def finish_game(room_code, session):
-    players = (await session.execute(
-        select(Player).where(Player.room_code == room_code).order_by(Player.score.desc())
-    )).scalars().all()
-
+async def finish_game(session, room, players):
+    room_code = room.code
+    players = sorted(players, key=lambda p: p.score, reverse=True)
     if not players: return
 
     text = "🏆 **ИГРА ОКОНЧЕНА!** 🏆\n\nИтоговая таблица:\n"
     for i, p in enumerate(players):
         medal = "🥇" if i == 0 else "🥈" if i == 1 else "🥉" if i == 2 else "🔹"
-        text += f"{medal} {p.username} — {p.score}\n"
+        text += f"{medal} {escape_markdown(p.username)} — {p.score}\n"
 
     winner = players[0]
-    text += f"\nПобедитель: **{winner.username}**! Поздравляем!"
+    text += f"\nПобедитель: **{escape_markdown(winner.username)}**! Поздравляем!"
 
+    if group_boards.update(room_code, round=text, progress="", leaderboard=""):
+        await group_boards.flush(room_code)
+    else:
+        await broadcaster.broadcast([p.user_id for p in players], text, parse_mode="Markdown")
     for p in players:
-        try:
-            await bot.send_message(p.user_id, text, parse_mode="Markdown")
-            state_key = StorageKey(bot_id=bot.id, chat_id=p.user_id, user_id=p.user_id)
-            await FSMContext(dp.storage, state_key).clear()
-        except:
-            pass
-
+        state_key = StorageKey(bot_id=bot.id, chat_id=p.user_id, user_id=p.user_id)
+        await FSMContext(dp.storage, state_key).clear()
 
+    await archive_game(session, room, players)
+    tournament_changes = [(p.user_id, p.username, 0, 1) for p in players]
+    version = room.tournament_id and await tournaments.add_scores(session, room.tournament_id, tournament_changes)
     await session.execute(delete(Card).where(Card.room_code == room_code))
+    await session.execute(delete(RoundAnswer).where(RoundAnswer.room_code == room_code))
+    room_state.drop(room_code)
+    answer_buffer.drop_room(room_code)
+    player_cache.forget_room(room_code)
+    host_panels.drop(room_code)
+    group_boards.drop(room_code)
 
-    room = await session.get(Room, room_code)
-    if room:
-        await session.delete(room)
+    await session.delete(room)
 
     await session.commit()
+    if version:
+        tournaments.apply(room.tournament_id, version, tournament_changes)
+    room_codes.release(room_code)
+    event_log.record(events.GAME_FINISHED, room_code, round_number=room.round_number, winner=winner.user_id)
     print(f"Комната {room_code} и данные игроков удалены.")
 
-@dp.message(F.text, StateFilter(None))
+@dp.message(F.text, F.chat.type == "private", StateFilter(None))
 async def default_handler(message: types.Message):
     await message.answer(
         "Я вас не понимаю. 🤔\n"
@@ -774,10 +969,46 @@ async def default_handler(message: types.Message):
         "или нажмите /start для выхода в главное меню."
     )
 
-async def main():
+async def on_startup():
     await init_db()
-    await dp.start_polling(bot)
+    await init_packs(async_session)
+    await room_codes.rebuild(async_session)
+    await group_boards.restore()
+    await round_signals.start()
+    await round_scheduler.restore(async_session)
+    tasks = [
+        asyncio.create_task(round_scheduler.run()),
+        asyncio.create_task(room_state.run_flusher()),
+        asyncio.create_task(event_log.run_flusher()),
+        asyncio.create_task(query_metrics.run_reporter(DB_METRICS_LOG_INTERVAL)),
+        asyncio.create_task(room_sweeper.run(ROOM_SWEEP_INTERVAL)),
+    ]
+    if METRICS_PORT:
+        tasks.append(asyncio.create_task(run_metrics_server(METRICS_HOST, METRICS_PORT)))
+    return tasks
+
+
+async def on_shutdown(background_tasks):
+    for task in background_tasks:
+        task.cancel()
+    await answer_buffer.flush_all()
+    await room_state.close()
+    await event_log.close()
+    await round_signals.close()
+
+
+async def main():
+    background_tasks = await on_startup()
+    try:
+        if DELIVERY_MODE == "webhook":
+            await run_webhook(dp, bot, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                              public_url=WEBHOOK_URL, max_in_flight=WEBHOOK_MAX_IN_FLIGHT)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await on_shutdown(background_tasks)
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     asyncio.run(main())
\ No newline at end of file
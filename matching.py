@@ -0,0 +1,128 @@
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from config import MATCH_STRICTNESS
+
+# Уровни строгости сравнения ответов:
+# normalized — регистр, ё/е, пунктуация и лишние пробелы не важны;
+# stemmed — плюс отбрасываются типичные окончания («кошки» = «кошка»);
+# fuzzy — плюс допускаются опечатки (расстояние Левенштейна 1–2 в зависимости от длины), включается явно.
+NORMALIZED, STEMMED, FUZZY = "normalized", "stemmed", "fuzzy"
+LEVELS = (NORMALIZED, STEMMED, FUZZY)
+
+_PUNCTUATION = re.compile(r"[^\w\s]|_")
+_ENDINGS = sorted([
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ах", "ях", "ов", "ев", "ей",
+    "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ые", "ие", "ам", "ям", "ом", "ем",
+    "ы", "и", "а", "я", "о", "е", "у", "ю", "ь", "й",
+], key=len, reverse=True)
+MIN_STEM = 3
+# Индекс удалений для строки длины L — около L²/2 вариантов, поэтому длинные формы сравниваются только точно
+MAX_FUZZY_LENGTH = 24
+
+
+def parse_strictness(value):
+    strictness = {"sync": STEMMED, "diff": STEMMED, "express": STEMMED}
+    for item in value.split(","):
+        if "=" in item:
+            r_type, level = (part.strip() for part in item.split("=", 1))
+            if level not in LEVELS:
+                raise ValueError(f"Неизвестная строгость сравнения: {level}")
+            strictness[r_type] = level
+    return strictness
+
+
+ROUND_STRICTNESS = parse_strictness(MATCH_STRICTNESS)
+
+
+@lru_cache(maxsize=65536)
+def normalize(answer):
+    text = answer.lower().replace("ё", "е")
+    return " ".join(_PUNCTUATION.sub(" ", text).split())
+
+
+def _stem_word(word):
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+@lru_cache(maxsize=65536)
+def stem(text):
+    return " ".join(_stem_word(word) for word in text.split())
+
+
+def max_distance(length):
+    # Короткие основы на расстоянии 1 — чаще разные слова, чем опечатка: пирог/порог, машин/малин
+    if length < 6 or length > MAX_FUZZY_LENGTH:
+        return 0
+    return 1 if length < 9 else 2
+
+
+def levenshtein(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def _deletes(word, depth):
+    variants = frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        variants = variants | frontier
+    return variants
+
+
+def similar(form, other):
+    # Опечатку в первой букве не допускаем: так расходятся разные слова вроде коронк/воронк
+    if form[:1] != other[:1]:
+        return False
+    return levenshtein(form, other) <= max_distance(min(len(form), len(other)))
+
+
+def cluster(forms):
+    # forms — в порядке приоритета: форма становится представителем группы, если не похожа
+    # ни на одного из уже выбранных, иначе присоединяется к ближайшему из них. Сравнение идёт
+    # только с представителями, поэтому группа не растёт цепочкой (корона → коронка → воронка).
+    # Кандидаты берутся из индекса удалений: у строк на расстоянии ≤ d есть общий вариант,
+    # полученный удалением ≤ d символов из каждой, так что все пары не перебираются.
+    groups = {}
+    order = {}
+    buckets = defaultdict(list)
+    for form in forms:
+        if form in groups:
+            continue
+        variants = _deletes(form, max_distance(len(form)))
+        candidates = {rep for variant in variants for rep in buckets.get(variant, ())}
+        matches = [(levenshtein(form, rep), order[rep], rep) for rep in candidates if similar(form, rep)]
+        if matches:
+            groups[form] = min(matches)[2]
+            continue
+        groups[form] = form
+        order[form] = len(order)
+        for variant in variants:
+            buckets[variant].append(form)
+    return groups
+
+
+def canonical_answers(answers_map, level):
+    # answers_map: {player_id: [нормализованный ответ, ...]} -> те же ответы, приведённые к ключам сравнения
+    if level == NORMALIZED:
+        return answers_map
+
+    stemmed = {player_id: [stem(a) for a in answers] for player_id, answers in answers_map.items()}
+    if level == STEMMED:
+        return stemmed
+
+    # Представителем становится самое частое написание
+    counts = Counter(a for answers in stemmed.values() for a in answers)
+    groups = cluster(sorted(counts, key=lambda a: (-counts[a], a)))
+    return {player_id: [groups[a] for a in answers] for player_id, answers in stemmed.items()}
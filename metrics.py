@@ -0,0 +1,340 @@
+import asyncio
+import cProfile
+import itertools
+import logging
+import math
+import os
+import random
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+from sqlalchemy import event as sa_event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueryBudget:
+    handler: str
+    state: Optional[str] = None
+    queries: int = 0
+    db_time: float = 0.0
+    pool_wait: float = 0.0
+    api_calls: int = 0
+    api_time: float = 0.0  # время, когда был в полёте хотя бы один запрос к Bot API
+    api_in_flight: int = 0
+    api_since: float = 0.0
+
+    def api_started(self):
+        self.api_calls += 1
+        if self.api_in_flight == 0:
+            self.api_since = time.perf_counter()
+        self.api_in_flight += 1
+
+    def api_finished(self):
+        self.api_in_flight -= 1
+        if self.api_in_flight == 0:
+            self.api_time += time.perf_counter() - self.api_since
+
+
+@dataclass
+class HandlerStats:
+    calls: int = 0
+    queries: int = 0
+    db_time: float = 0.0
+    pool_wait: float = 0.0
+    max_queries: int = 0
+
+
+class LatencyHistogram:
+    # Логарифмические корзины, как в HdrHistogram: 16 корзин на удвоение, погрешность квантилей ~4%
+    SUB_BUCKETS = 16
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = max(1.0, seconds * 1_000_000)
+        self.buckets[int(math.log2(micros) * self.SUB_BUCKETS)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.max, 2 ** ((index + 1) / self.SUB_BUCKETS) / 1_000_000)
+        return self.max
+
+
+@dataclass
+class UpdateStats:
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    db_time: float = 0.0
+    api_time: float = 0.0
+    python_time: float = 0.0
+    slow: int = 0
+
+
+current_budget: ContextVar[Optional[QueryBudget]] = ContextVar("current_budget", default=None)
+
+
+class QueryMetrics:
+    def __init__(self):
+        self.handlers = defaultdict(HandlerStats)
+        self.updates = defaultdict(UpdateStats)  # (хендлер, состояние FSM) -> UpdateStats
+        self.engine = None
+
+    def instrument(self, engine):
+        self.engine = engine
+        sync_engine = getattr(engine, "sync_engine", engine)
+        sa_event.listen(sync_engine, "before_cursor_execute", self._before_execute)
+        sa_event.listen(sync_engine, "after_cursor_execute", self._after_execute)
+
+    @staticmethod
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @staticmethod
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        budget = current_budget.get()
+        if budget is not None:
+            budget.queries += 1
+            budget.db_time += time.perf_counter() - conn.info.pop("query_started")
+
+    @staticmethod
+    def record_pool_wait(seconds):
+        budget = current_budget.get()
+        if budget is not None:
+            budget.pool_wait += seconds
+
+    def record(self, budget):
+        stats = self.handlers[budget.handler]
+        stats.calls += 1
+        stats.queries += budget.queries
+        stats.db_time += budget.db_time
+        stats.pool_wait += budget.pool_wait
+        stats.max_queries = max(stats.max_queries, budget.queries)
+
+    def record_update(self, budget, elapsed, slow=False):
+        stats = self.updates[(budget.handler, budget.state or "")]
+        stats.latency.record(elapsed)
+        stats.db_time += budget.db_time
+        stats.api_time += budget.api_time
+        stats.python_time += max(0.0, elapsed - budget.db_time - budget.api_time)
+        stats.slow += slow
+
+    @asynccontextmanager
+    async def budget(self, handler):
+        budget = QueryBudget(handler)
+        token = current_budget.set(budget)
+        try:
+            yield budget
+        finally:
+            current_budget.reset(token)
+            self.record(budget)
+
+    def pool_status(self):
+        pool = self.engine.sync_engine.pool if self.engine is not None else None
+        if not isinstance(pool, AsyncAdaptedQueuePool):
+            return {}
+        return {"size": pool.size(), "checked_out": pool.checkedout(), "overflow": pool.overflow()}
+
+    def render_prometheus(self):
+        lines = []
+        metrics = [
+            ("smyslov_handler_calls_total", "counter", "calls"),
+            ("smyslov_handler_queries_total", "counter", "queries"),
+            ("smyslov_handler_db_seconds_total", "counter", "db_time"),
+            ("smyslov_handler_pool_wait_seconds_total", "counter", "pool_wait"),
+            ("smyslov_handler_queries_max", "gauge", "max_queries"),
+        ]
+        for name, kind, attr in metrics:
+            lines.append(f"# TYPE {name} {kind}")
+            for handler, stats in sorted(self.handlers.items()):
+                lines.append(f'{name}{{handler="{handler}"}} {getattr(stats, attr)}')
+        update_metrics = [
+            ("smyslov_update_db_seconds_total", "db_time"),
+            ("smyslov_update_api_seconds_total", "api_time"),
+            ("smyslov_update_python_seconds_total", "python_time"),
+            ("smyslov_update_slow_total", "slow"),
+        ]
+        lines.append("# TYPE smyslov_update_seconds summary")
+        for (handler, state), stats in sorted(self.updates.items()):
+            labels = f'handler="{handler}",state="{state}"'
+            for q in (0.5, 0.9, 0.99):
+                lines.append(f'smyslov_update_seconds{{{labels},quantile="{q}"}} {stats.latency.quantile(q):.6f}')
+            lines.append(f"smyslov_update_seconds_sum{{{labels}}} {stats.latency.total:.6f}")
+            lines.append(f"smyslov_update_seconds_count{{{labels}}} {stats.latency.count}")
+        for name, attr in update_metrics:
+            lines.append(f"# TYPE {name} counter")
+            for (handler, state), stats in sorted(self.updates.items()):
+                lines.append(f'{name}{{handler="{handler}",state="{state}"}} {getattr(stats, attr):g}')
+        for key, value in self.pool_status().items():
+            lines.append(f"# TYPE smyslov_db_pool_{key} gauge")
+            lines.append(f"smyslov_db_pool_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        lines = []
+        for handler, stats in sorted(self.handlers.items(), key=lambda item: -item[1].db_time):
+            lines.append(
+                f"{handler}: вызовов {stats.calls}, запросов {stats.queries / stats.calls:.1f}/вызов "
+                f"(макс. {stats.max_queries}), БД {stats.db_time * 1000 / stats.calls:.1f} мс/вызов, "
+                f"ожидание пула {stats.pool_wait * 1000 / stats.calls:.1f} мс/вызов")
+        pool = self.pool_status()
+        if pool:
+            lines.append(f"пул: {pool}")
+        return "\n".join(lines)
+
+    def update_summary(self, limit=10):
+        rows = sorted(self.updates.items(), key=lambda item: -item[1].latency.quantile(0.95))[:limit]
+        lines = []
+        for (handler, state), stats in rows:
+            total = stats.latency.total or 1
+            lines.append(
+                f"{handler}" + (f" [{state}]" if state else "") + f": {stats.latency.count} шт., "
+                f"p50 {stats.latency.quantile(0.5) * 1000:.0f} / p95 {stats.latency.quantile(0.95) * 1000:.0f} / "
+                f"p99 {stats.latency.quantile(0.99) * 1000:.0f} мс; БД {stats.db_time / total:.0%}, "
+                f"API {stats.api_time / total:.0%}, Python {stats.python_time / total:.0%}")
+        return "\n".join(lines)
+
+    async def run_reporter(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            if self.handlers:
+                logger.info("Нагрузка на БД по хендлерам:\n%s", self.summary())
+
+
+query_metrics = QueryMetrics()
+
+
+def spawn(handler, coro):
+    # Фоновая задача копирует контекст хендлера, а с ним и его бюджет, который к её запросам
+    # уже закрыт. Поэтому у задачи свой бюджет под своим именем.
+    async def run():
+        async with query_metrics.budget(handler):
+            return await coro
+    return asyncio.create_task(run())
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # Время, которое апдейт провёл в ожидании свободного соединения
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            query_metrics.record_pool_wait(time.perf_counter() - started)
+
+
+class QueryBudgetMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else type(event).__name__
+        budget = current_budget.get()
+        if budget is not None:
+            # Бюджет уже открыт UpdateMetricsMiddleware — осталось назвать его по хендлеру
+            budget.handler = name
+            return await handler(event, data)
+        async with query_metrics.budget(name):
+            return await handler(event, data)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    # Внешний middleware на dp.update: время каждого апдейта по хендлеру и состоянию FSM.
+    # Примерно каждый 1/sample_rate апдейт профилируется; профиль сохраняется, если апдейт оказался медленным.
+    # cProfile видит весь поток, поэтому в профиль попадают и корутины, работавшие параллельно.
+    def __init__(self, slow_threshold=1.0, profile_dir=None, sample_rate=0.0):
+        self.slow_threshold = slow_threshold
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.profiling = False
+        self.dumps = itertools.count()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        profiler = None
+        if self.profile_dir and not self.profiling and random.random() < self.sample_rate:
+            self.profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        async with query_metrics.budget(getattr(event, "event_type", type(event).__name__)) as budget:
+            budget.state = data.get("raw_state")
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                elapsed = time.perf_counter() - started
+                slow = elapsed >= self.slow_threshold
+                query_metrics.record_update(budget, elapsed, slow)
+                if slow:
+                    logger.warning("Медленный апдейт %s (%s): %.0f мс, БД %.0f мс, API %.0f мс", budget.handler,
+                                   budget.state or "-", elapsed * 1000, budget.db_time * 1000, budget.api_time * 1000)
+                if profiler is not None:
+                    profiler.disable()
+                    self.profiling = False
+                    if slow:
+                        self._dump(profiler, budget.handler)
+
+    def _dump(self, profiler, name):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{next(self.dumps)}-{name}.prof")
+        profiler.dump_stats(path)
+        logger.warning("Профиль медленного апдейта сохранён: %s", path)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    # Время запросов к Bot API внутри текущего бюджета
+    async def __call__(self, make_request, bot, method):
+        budget = current_budget.get()
+        if budget is None:
+            return await make_request(bot, method)
+        budget.api_started()
+        try:
+            return await make_request(bot, method)
+        finally:
+            budget.api_finished()
+
+
+async def run_metrics_server(host, port, path="/metrics"):
+    async def handle(request):
+        return web.Response(text=query_metrics.render_prometheus(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get(path, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s%s", host, port, path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import random
+from collections import namedtuple
+
+from sqlalchemy import delete, insert, select
+
+from database import Card, CardPack
+
+DEFAULT_STANDARD = [
+    "Кошки", "Ванная комната",
+    "Почта", "Грибы",
+    "Школа", "Япония",
+    "Обитатели зоопарка", "Кухни",
+    "Металлы", "Транспортные средства",
+    "Грызуны", "Футбольные клубы",
+    "Созвездия", "Российские музыкальные исполнители",
+    "Настольные игры", "Канцелярские принадлежности",
+    "Фрукты", "Марки машин",
+    "Сказки", "Цвета",
+    "Выпечка", "Танцы",
+    "Существительные заканчивающиеся на «-аль»", "Детективные фильмы и сериалы",
+    "Фильмы и сериалы про войну", "Центр города",
+    "Цирк", "Книги, в названии которых есть числительное",
+    "Электрические приборы", "Архитектурные сооружения",
+    "Зарубежные актёры", "Персонажи мультфильмов",
+]
+
+DEFAULT_EXPRESS = [
+    "Кофе|Монета|Капитан ...|Жалящее насекомое|Головной убор|Чувство",
+    "Пирожное|Слово, заканчивающееся на «-но»|Музыкальная группа 90-х|Торговая сеть|Фокусник|Ирландия",
+    "Флот|Ландшафт|Известная Наталья|Островное государство|Дорожный Знак|Комик",
+    "Маргарита|Воинское звание|Известное высотное сооружение|Римский император|Компьютерная игра|Обезьяна",
+    "Дворец|Сектор|Фильм про шпионов|Начинка для конфет|Нелетающая птица|Солнце",
+    "Царь из сказки|Известная пара|Ядовитое растение|Пушной зверь|Гоночный автомобиль|Деталь музыкального инструмента",
+    "Сахар|Германия|Популярная профессия|Водный вид спорта|Герой анекдота|Ящерица",
+    "Испания|Метательное оружие|Киностудия|Культурное растение|Начинка для пиццы|Муза",
+    "Кубок|Порода маленьких собак|Промежуток времени|Чистящее средство|Земля|Банк",
+    "Физик|Рок-н-ролл|Аттракцион|Известный Михаил|Ювелирное украшение|Баскетбол",
+    "Змея|Река|Спорт|Птица|Авто|Инструмент",
+]
+
+PACKS = {
+    "default": [(text, False) for text in DEFAULT_STANDARD] + [(text, True) for text in DEFAULT_EXPRESS],
+}
+
+CachedCard = namedtuple("CachedCard", ["id", "text", "is_blitz"])
+
+
+def pack_checksum(cards):
+    payload = json.dumps(cards, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def seed_pack(session, name, cards):
+    checksum = pack_checksum(cards)
+    pack = await session.scalar(select(CardPack).where(CardPack.name == name))
+    if pack and pack.checksum == checksum:
+        return False
+
+    if pack is None:
+        pack = CardPack(name=name, version=1, checksum=checksum)
+        session.add(pack)
+        await session.flush()
+        if name == "default":
+            # Старые версии бота сидили общие карты без пакета
+            await session.execute(delete(Card).where(Card.room_code == None, Card.pack_id == None))
+    else:
+        pack.version += 1
+        pack.checksum = checksum
+        await session.execute(delete(Card).where(Card.pack_id == pack.id))
+
+    await session.execute(insert(Card), [{"text": text, "is_blitz": is_blitz, "pack_id": pack.id}
+                                         for text, is_blitz in cards])
+    return True
+
+
+class DefaultDeck:
+    # Общие карты целиком в памяти: раунды с ними не ходят в БД
+    def __init__(self):
+        self.versions = None
+        self.cards = {}
+        self.ids = {False: (), True: ()}
+
+    async def load(self, session):
+        versions = tuple((await session.execute(
+            select(CardPack.name, CardPack.version).order_by(CardPack.name))).all())
+        if versions == self.versions:
+            return False
+
+        rows = (await session.execute(
+            select(Card.id, Card.text, Card.is_blitz).where(Card.room_code == None))).all()
+        cards = {row.id: CachedCard(row.id, row.text, row.is_blitz) for row in rows}
+        self.ids = {kind: tuple(c.id for c in cards.values() if c.is_blitz == kind) for kind in (False, True)}
+        self.cards = cards
+        self.versions = versions
+        return True
+
+    def get(self, card_id):
+        return self.cards.get(card_id)
+
+    def sample(self, is_blitz, count):
+        ids = self.ids[is_blitz]
+        return random.sample(ids, min(count, len(ids)))
+
+
+default_deck = DefaultDeck()
+
+
+async def init_packs(session_factory):
+    async with session_factory() as session:
+        for name, cards in PACKS.items():
+            await seed_pack(session, name, cards)
+        await session.commit()
+        await default_deck.load(session)
@@ -0,0 +1,77 @@
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import select
+
+from database import Player, Room
+
+Membership = namedtuple("Membership", ["player_id", "room_code", "is_host"])
+
+
+class PlayerResolver:
+    # Кэш «в какой комнате пользователь»: LRU на maxsize записей, каждая живёт не дольше ttl секунд.
+    # Отрицательные ответы не кэшируются — вход в комнату на другом воркере виден сразу.
+    # Записи сбрасываются при входе, выходе, остановке и завершении игры.
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # user_id -> (истекает, Membership)
+        self.rooms = {}  # room_code -> {user_id, ...}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self.forget(user_id)
+            return None
+        self.entries.move_to_end(user_id)
+        return entry[1]
+
+    def remember(self, user_id, membership):
+        self.forget(user_id)
+        self.entries[user_id] = (time.monotonic() + self.ttl, membership)
+        self.rooms.setdefault(membership.room_code, set()).add(user_id)
+        while len(self.entries) > self.maxsize:
+            self.forget(next(iter(self.entries)))
+
+    def forget(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry is not None:
+            users = self.rooms.get(entry[1].room_code)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self.rooms[entry[1].room_code]
+
+    def forget_room(self, room_code):
+        for user_id in list(self.rooms.get(room_code, ())):
+            self.forget(user_id)
+
+    async def resolve(self, session, user_id):
+        membership = self.get(user_id)
+        if membership is not None:
+            self.hits += 1
+            return membership
+
+        self.misses += 1
+        row = (await session.execute(
+            select(Player.id, Player.room_code, Room.host_id).join(Room, Player.room_code == Room.code).where(
+                Player.user_id == user_id).order_by(Player.id.desc()).limit(1))).first()
+        if row is None:
+            return None
+
+        membership = Membership(row.id, row.room_code, row.host_id == user_id)
+        self.remember(user_id, membership)
+        return membership
+
+    async def confirm(self, session, user_id):
+        # Для отказов по членству: запись кэша могла пережить выход или удаление комнаты на другом
+        # воркере, поэтому её строка игрока перепроверяется точечным запросом
+        membership = self.get(user_id)
+        if membership is not None and await session.scalar(
+                select(Player.id).where(Player.id == membership.player_id)) is None:
+            self.forget(user_id)
+        return await self.resolve(session, user_id)
@@ -0,0 +1,124 @@
+import random
+import string
+import time
+from collections import deque
+
+from sqlalchemy import select
+
+from database import Room
+
+ALPHABET = string.ascii_uppercase + string.digits
+MAX_PROBES = 64
+
+
+def encode(number, length):
+    chars = []
+    for _ in range(length):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def decode(code):
+    number = 0
+    for char in code:
+        number = number * len(ALPHABET) + ALPHABET.index(char)
+    return number
+
+
+class CodeSpace:
+    # Битовая карта занятых кодов одной длины: 36⁴ кодов — около 210 КБ
+    def __init__(self, length):
+        self.length = length
+        self.size = len(ALPHABET) ** length
+        self.bits = bytearray((self.size + 7) // 8)
+        self.used = 0
+
+    def is_used(self, number):
+        return bool(self.bits[number >> 3] & (1 << (number & 7)))
+
+    def set(self, number):
+        if not self.is_used(number):
+            self.bits[number >> 3] |= 1 << (number & 7)
+            self.used += 1
+
+    def clear(self, number):
+        if self.is_used(number):
+            self.bits[number >> 3] &= ~(1 << (number & 7)) & 0xFF
+            self.used -= 1
+
+    @property
+    def occupancy(self):
+        return self.used / self.size
+
+    def take(self):
+        # Пока занято меньше половины, случайная проба попадает в свободный код в среднем за ≤ 2 попытки
+        for _ in range(MAX_PROBES):
+            number = random.randrange(self.size)
+            if not self.is_used(number):
+                self.set(number)
+                return number
+
+        start = random.randrange(len(self.bits))
+        for offset in range(len(self.bits)):
+            i = (start + offset) % len(self.bits)
+            if self.bits[i] != 0xFF:
+                for bit in range(8):
+                    number = i * 8 + bit
+                    if number < self.size and not self.is_used(number):
+                        self.set(number)
+                        return number
+        return None
+
+
+class RoomCodeAllocator:
+    # Выдаёт коды комнат без похода в БД. Освобождённые коды возвращаются в пул не сразу,
+    # а через cooldown секунд, чтобы запоздавший /join не попал в чужую новую комнату.
+    # Когда занято больше threshold кодов текущей длины, выдаются коды на символ длиннее.
+    def __init__(self, min_length=4, max_length=5, threshold=0.5, cooldown=600):
+        self.min_length = min_length
+        self.max_length = max_length
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.spaces = {}
+        self.released = deque()  # (когда можно выдавать снова, код)
+
+    def _space(self, length):
+        if length not in self.spaces:
+            self.spaces[length] = CodeSpace(length)
+        return self.spaces[length]
+
+    def _valid(self, code):
+        return self.min_length <= len(code) <= self.max_length and all(c in ALPHABET for c in code)
+
+    def _recycle(self):
+        now = time.monotonic()
+        while self.released and self.released[0][0] <= now:
+            _, code = self.released.popleft()
+            self._space(len(code)).clear(decode(code))
+
+    def allocate(self):
+        self._recycle()
+        for length in range(self.min_length, self.max_length + 1):
+            space = self._space(length)
+            if space.occupancy < self.threshold or length == self.max_length:
+                number = space.take()
+                if number is not None:
+                    return encode(number, length)
+        raise RuntimeError("Свободные коды комнат закончились")
+
+    def mark_used(self, code):
+        if self._valid(code):
+            self._space(len(code)).set(decode(code))
+
+    def release(self, code):
+        if self._valid(code):
+            self.released.append((time.monotonic() + self.cooldown, code))
+
+    async def rebuild(self, session_factory):
+        self.spaces.clear()
+        self.released.clear()
+        async with session_factory() as session:
+            codes = (await session.execute(select(Room.code))).scalars().all()
+        for code in codes:
+            self.mark_used(code)
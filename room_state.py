@@ -0,0 +1,226 @@
+import asyncio
+import logging
+from collections import namedtuple
+from dataclasses import dataclass, field
+
+from sqlalchemy import func, select, update
+
+from answers import load_answers, replace_answers
+from database import Player, Room
+
+logger = logging.getLogger(__name__)
+
+# completed — именно это нажатие сделало готовыми всех игроков комнаты
+ReadyResult = namedtuple("ReadyResult", ["room_code", "ready", "total", "completed"])
+
+
+def build_room_state(backend, session_factory, flush_interval):
+    if backend == "memory":
+        return RoomStateStore(session_factory, flush_interval=flush_interval)
+    if backend == "database":
+        return DatabaseRoomState(session_factory)
+    raise ValueError(f"Неизвестное хранилище состояния комнат: {backend}")
+
+
+@dataclass
+class PlayerState:
+    player_id: int
+    user_id: int
+    answers: list = field(default_factory=list)
+    is_ready: bool = False
+    answers_dirty: bool = False
+    ready_dirty: bool = False
+
+
+@dataclass
+class RoomState:
+    code: str
+    round_number: int
+    players: dict = field(default_factory=dict)  # user_id -> PlayerState
+    ready_count: int = 0
+
+    @property
+    def total(self):
+        return len(self.players)
+
+
+class RoomStateStore:
+    # Во время writing_answers ответы и готовность живут в памяти,
+    # а в players/round_answers сбрасываются пачкой: по таймеру, в конце раунда и при остановке бота.
+    def __init__(self, session_factory, flush_interval=5.0):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.rooms = {}
+        self.by_user = {}
+        self.flush_lock = asyncio.Lock()
+
+    def load(self, room_code, round_number, players, answers=None):
+        self.drop(room_code)
+        room = RoomState(code=room_code, round_number=round_number)
+        for p in players:
+            room.players[p.user_id] = PlayerState(p.id, p.user_id, list((answers or {}).get(p.id, [])), p.is_ready)
+            self.by_user[p.user_id] = room_code
+        room.ready_count = sum(1 for p in room.players.values() if p.is_ready)
+        self.rooms[room_code] = room
+        return room
+
+    def drop(self, room_code):
+        room = self.rooms.pop(room_code, None)
+        if room:
+            for user_id in room.players:
+                if self.by_user.get(user_id) == room_code:
+                    del self.by_user[user_id]
+
+    def remove_player(self, user_id):
+        room_code = self.by_user.pop(user_id, None)
+        room = self.rooms.get(room_code)
+        if room:
+            player = room.players.pop(user_id, None)
+            if player and player.is_ready:
+                room.ready_count -= 1
+
+    async def lookup(self, user_id):
+        room_code = self.by_user.get(user_id)
+        if room_code is None:
+            # Раунд мог начаться до перезапуска бота — поднимаем комнату из БД
+            async with self.session_factory() as session:
+                row = (await session.execute(
+                    select(Room.code, Room.status, Room.round_number).join(Player, Player.room_code == Room.code).where(
+                        Player.user_id == user_id))).first()
+                if not row or row.status != "playing":
+                    return None
+                players = (await session.execute(select(Player).where(Player.room_code == row.code))).scalars().all()
+                answers = await load_answers(session, row.code, row.round_number, raw=True)
+            # Пока ждали БД, комнату мог загрузить соседний апдейт
+            room_code = self.by_user.get(user_id) or self.load(row.code, row.round_number, players, answers).code
+
+        room = self.rooms[room_code]
+        return room, room.players[user_id]
+
+    async def submit_answers(self, user_id, answers):
+        found = await self.lookup(user_id)
+        if not found:
+            return None
+        room, player = found
+        player.answers = answers
+        player.answers_dirty = True
+        return room, player
+
+    async def mark_ready(self, user_id):
+        found = await self.lookup(user_id)
+        if not found:
+            return None
+        room, player = found
+        if player.is_ready:
+            return ReadyResult(room.code, room.ready_count, room.total, False)
+
+        player.is_ready = True
+        player.ready_dirty = True
+        room.ready_count += 1
+        return ReadyResult(room.code, room.ready_count, room.total, room.ready_count == room.total)
+
+    async def flush(self, room_code=None):
+        async with self.flush_lock:
+            if room_code is None:
+                rooms = list(self.rooms.values())
+            else:
+                rooms = [self.rooms[room_code]] if room_code in self.rooms else []
+            submissions = [(p, room) for room in rooms for p in room.players.values() if p.answers_dirty]
+            ready = [p for room in rooms for p in room.players.values() if p.ready_dirty]
+            if not submissions and not ready:
+                return 0
+
+            for p, _ in submissions:
+                p.answers_dirty = False
+            for p in ready:
+                p.ready_dirty = False
+            try:
+                async with self.session_factory() as session:
+                    await replace_answers(session, [
+                        (p.player_id, room.code, room.round_number, p.answers) for p, room in submissions
+                    ])
+                    if ready:
+                        await session.execute(update(Player), [{"id": p.player_id, "is_ready": True} for p in ready])
+                    await session.commit()
+            except Exception:
+                for p, _ in submissions:
+                    p.answers_dirty = True
+                for p in ready:
+                    p.ready_dirty = True
+                raise
+            return len(submissions) + len(ready)
+
+    async def release(self, room_code):
+        await self.flush(room_code)
+        self.drop(room_code)
+
+    async def run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Не удалось сохранить состояние комнат")
+
+    async def close(self):
+        await self.flush()
+
+
+class DatabaseRoomState:
+    # Для нескольких воркеров: ничего не кэшируем, каждый апдейт сразу пишется в БД
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    def load(self, room_code, round_number, players, answers=None):
+        pass
+
+    def drop(self, room_code):
+        pass
+
+    def remove_player(self, user_id):
+        pass
+
+    async def submit_answers(self, user_id, answers):
+        async with self.session_factory() as session:
+            row = (await session.execute(
+                select(Player.id, Room.code, Room.round_number).join(Room, Player.room_code == Room.code).where(
+                    Player.user_id == user_id, Room.status == "playing"))).first()
+            if not row:
+                return False
+            await replace_answers(session, [(row.id, row.code, row.round_number, answers)])
+            await session.commit()
+        return True
+
+    async def mark_ready(self, user_id):
+        async with self.session_factory() as session:
+            room_code = await session.scalar(
+                update(Player).where(Player.user_id == user_id, Player.is_ready == False).values(
+                    is_ready=True).returning(Player.room_code).execution_options(synchronize_session=False))
+            flipped = room_code is not None
+
+            if flipped:
+                # Параллельные нажатия в одной комнате считаются по очереди под блокировкой строки комнаты,
+                # поэтому последнее из них видит все остальные и «все готовы» наступает ровно один раз
+                await session.execute(select(Room.code).where(Room.code == room_code).with_for_update())
+            else:
+                room_code = await session.scalar(select(Player.room_code).where(Player.user_id == user_id))
+                if room_code is None:
+                    return None
+
+            total, ready = (await session.execute(
+                select(func.count(Player.id), func.count(Player.id).filter(Player.is_ready == True)).where(
+                    Player.room_code == room_code))).one()
+            await session.commit()
+        return ReadyResult(room_code, ready, total, flipped and ready == total)
+
+    async def flush(self, room_code=None):
+        return 0
+
+    async def release(self, room_code):
+        pass
+
+    async def run_flusher(self):
+        pass
+
+    async def close(self):
+        pass
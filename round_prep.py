@@ -0,0 +1,82 @@
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update
+
+from config import ROUND_DURATION
+from database import Room
+from deck import draw_card
+from metrics import spawn
+
+logger = logging.getLogger(__name__)
+
+RESERVE_CARD = "Резерв"
+
+
+@dataclass
+class PreparedRound:
+    room_code: str
+    round_number: int
+    card_text: str
+    deck: dict  # колода после того, как из неё вытянули карту
+    duration: int
+    prompt: str
+
+
+class RoundPreparer:
+    # Следующий раунд готовится, пока хост проверяет очки: карта вытянута, задание отрисовано.
+    # По «Следующему раунду» остаётся записать его одним UPDATE и разослать. Подготовка ничего
+    # не пишет в БД, поэтому остановка игры или смена состава её просто обесценивают.
+    # round_type(round_number) -> (тип, название); render(round_number, card_text) -> текст задания.
+    def __init__(self, session_factory, round_type, render):
+        self.session_factory = session_factory
+        self.round_type = round_type
+        self.render = render
+        self.tasks = {}
+
+    async def prepare(self, session, room_code, round_number, deck, duration):
+        # round_number — номер раунда, который будет запущен
+        r_type, _ = await self.round_type(round_number)
+        card, deck = await draw_card(session, deck, r_type == "express")
+        card_text = card.text if card is not None else RESERVE_CARD
+        prompt = await self.render(round_number, card_text)
+        return PreparedRound(room_code, round_number, card_text, deck, duration, prompt)
+
+    def schedule(self, room):
+        # Снимок комнаты берётся сразу: объект принадлежит чужой сессии
+        args = (room.code, room.round_number + 1, dict(room.deck or {}), room.round_duration or ROUND_DURATION)
+        self.discard(room.code)
+        self.tasks[room.code] = spawn("prepare_round", self._prepare_later(*args))
+
+    async def _prepare_later(self, *args):
+        async with self.session_factory() as session:
+            return await self.prepare(session, *args)
+
+    async def take(self, room_code):
+        # Хост мог нажать раньше, чем подготовка закончилась, — тогда дожидаемся её
+        task = self.tasks.pop(room_code, None)
+        if task is None or task.cancelled():
+            return None
+        try:
+            return await task
+        except Exception:
+            logger.exception("Не удалось подготовить раунд в комнате %s", room_code)
+            return None
+
+    def discard(self, room_code):
+        task = self.tasks.pop(room_code, None)
+        if task is not None:
+            task.cancel()
+
+    @staticmethod
+    async def claim(session, prepared):
+        # Раунд запускается, только если комната всё ещё играет предыдущий раунд — иначе подготовка устарела
+        now = datetime.now(timezone.utc)
+        deadline = now + timedelta(seconds=prepared.duration)
+        result = await session.execute(
+            update(Room).where(Room.code == prepared.room_code, Room.status == "playing",
+                               Room.round_number == prepared.round_number - 1).values(
+                round_number=prepared.round_number, current_card_text=prepared.card_text, deck=prepared.deck,
+                last_activity=now, round_deadline=deadline).execution_options(synchronize_session=False))
+        return deadline if result.rowcount == 1 else None
@@ -0,0 +1,94 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import timezone
+
+from sqlalchemy import select
+
+from database import Room
+
+logger = logging.getLogger(__name__)
+
+WARNING = "warning"
+CLOSE = "close"
+
+
+class RoundScheduler:
+    # Один таймер на все комнаты: куча дедлайнов (предупреждение за N секунд и закрытие раунда).
+    # Отменённые записи не удаляются из кучи, а пропускаются при извлечении.
+    def __init__(self, on_warning, on_close, warning_before=5):
+        self.on_warning = on_warning
+        self.on_close = on_close
+        self.warning_before = warning_before
+        self.heap = []
+        self.rounds = {}  # room_code -> round_number
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.tasks = set()
+
+    def _push(self, when, kind, room_code, round_number):
+        heapq.heappush(self.heap, (when, next(self.counter), kind, room_code, round_number))
+        if self.heap[0][2:] == (kind, room_code, round_number):
+            self.wakeup.set()
+
+    def schedule(self, room_code, round_number, deadline):
+        self.rounds[room_code] = round_number
+        if deadline - self.warning_before > time.time():
+            self._push(deadline - self.warning_before, WARNING, room_code, round_number)
+        self._push(deadline, CLOSE, room_code, round_number)
+
+    def close_now(self, room_code):
+        round_number = self.rounds.get(room_code)
+        if round_number is not None:
+            self._push(time.time(), CLOSE, room_code, round_number)
+
+    def cancel(self, room_code):
+        self.rounds.pop(room_code, None)
+
+    def _pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, _, kind, room_code, round_number = heapq.heappop(self.heap)
+            if self.rounds.get(room_code) != round_number:
+                continue
+            if kind == CLOSE:
+                del self.rounds[room_code]
+            due.append((kind, room_code, round_number))
+        return due
+
+    def _dispatch(self, kind, room_code, round_number):
+        handler = self.on_close if kind == CLOSE else self.on_warning
+        task = asyncio.create_task(handler(room_code, round_number))
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error("Ошибка в обработчике таймера раунда", exc_info=task.exception())
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            for kind, room_code, round_number in self._pop_due(time.time()):
+                self._dispatch(kind, room_code, round_number)
+
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def restore(self, session_factory):
+        async with session_factory() as session:
+            rows = (await session.execute(
+                select(Room.code, Room.round_number, Room.round_deadline).where(
+                    Room.status == "playing", Room.round_deadline != None))).all()
+        for row in rows:
+            deadline = row.round_deadline
+            if deadline.tzinfo is None:
+                deadline = deadline.replace(tzinfo=timezone.utc)
+            self.schedule(row.code, row.round_number, deadline.timestamp())
+        return len(rows)
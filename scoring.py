@@ -0,0 +1,42 @@
+from collections import Counter
+
+ANSWERS_PER_ROUND = 6
+# Ответ — слово или короткая фраза; длиннее обрезается при приёме
+MAX_ANSWER_LENGTH = 64
+
+
+def build_index(r_type, answers_map):
+    # Сколько разных игроков дали ответ (для экспресса — ответ на конкретной позиции)
+    index = Counter()
+    for answers in answers_map.values():
+        if r_type == "express":
+            index.update(set(enumerate(answers)))
+        else:
+            index.update(set(answers))
+    return index
+
+
+def count_matches(r_type, answers, index):
+    matches = 0
+    for i, answer in enumerate(answers):
+        key = (i, answer) if r_type == "express" else answer
+        # Свой ответ тоже лежит в индексе, поэтому совпадение — это минимум два игрока
+        if index[key] >= 2:
+            matches += 1
+    return matches
+
+
+def score_answers(r_type, answers, index):
+    matches = count_matches(r_type, answers, index)
+    hits = len(answers) - matches if r_type == "diff" else matches
+
+    score = hits
+    if len(answers) == ANSWERS_PER_ROUND and hits == ANSWERS_PER_ROUND:
+        score += 1
+    return score
+
+
+def score_round(r_type, answers_map, index=None):
+    if index is None:
+        index = build_index(r_type, answers_map)
+    return {player_id: score_answers(r_type, answers, index) for player_id, answers in answers_map.items()}
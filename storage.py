@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+logger = logging.getLogger(__name__)
+
+
+# FSM_STORAGE: memory | redis://host:port/db | sqlite:///path/to/state.db
+def build_storage(url):
+    if url == "memory":
+        return MemoryStorage()
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteStorage(url[len("sqlite:///"):])
+    raise ValueError(f"Неизвестное хранилище FSM: {url}")
+
+
+def build_round_signals(storage):
+    if isinstance(storage, SQLiteStorage):
+        return SQLiteRoundSignals(storage.path)
+    redis = getattr(storage, "redis", None)
+    if redis is not None:
+        return RedisRoundSignals(redis)
+    return RoundSignals()
+
+
+class SQLiteStorage(BaseStorage):
+    # Локальная замена Redis: файл можно открыть из нескольких процессов бота
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT)")
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def _key(key: StorageKey):
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    async def _run(self, sql, params):
+        async with self.lock:
+            return await asyncio.to_thread(lambda: self.conn.execute(sql, params).fetchone())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._run(
+            "INSERT INTO fsm (key, state) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+            (self._key(key), value))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self._run("SELECT state FROM fsm WHERE key = ?", (self._key(key),))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._run(
+            "INSERT INTO fsm (key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (self._key(key), json.dumps(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self._run("SELECT data FROM fsm WHERE key = ?", (self._key(key),))
+        return json.loads(row[0]) if row and row[0] else {}
+
+    async def close(self) -> None:
+        self.conn.close()
+
+
+class RoundSignals:
+    # Сигнал «раунд можно завершать». Базовая версия работает внутри одного процесса.
+    def __init__(self):
+        self.handlers = []
+
+    def subscribe(self, handler):
+        self.handlers.append(handler)
+
+    def _set_local(self, room_code):
+        for handler in self.handlers:
+            handler(room_code)
+
+    async def publish(self, room_code):
+        self._set_local(room_code)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class RedisRoundSignals(RoundSignals):
+    channel = "smyslov:round_done"
+
+    def __init__(self, redis):
+        super().__init__()
+        self.redis = redis
+        self.pubsub = None
+        self.listener = None
+
+    async def publish(self, room_code):
+        await self.redis.publish(self.channel, room_code)
+
+    async def start(self):
+        self.pubsub = self.redis.pubsub()
+        await self.pubsub.subscribe(self.channel)
+        self.listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        async for message in self.pubsub.listen():
+            if message["type"] == "message":
+                data = message["data"]
+                self._set_local(data.decode() if isinstance(data, bytes) else data)
+
+    async def close(self):
+        if self.listener:
+            self.listener.cancel()
+        if self.pubsub:
+            await self.pubsub.unsubscribe(self.channel)
+            await self.pubsub.close()
+
+
+class SQLiteRoundSignals(RoundSignals):
+    def __init__(self, path, poll_interval=0.2, ttl=300):
+        super().__init__()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS round_signals "
+                          "(id INTEGER PRIMARY KEY AUTOINCREMENT, room_code TEXT, created REAL)")
+        self.lock = asyncio.Lock()
+        self.poll_interval = poll_interval
+        self.ttl = ttl
+        self.last_id = 0
+        self.listener = None
+
+    async def _run(self, sql, params=()):
+        async with self.lock:
+            return await asyncio.to_thread(lambda: self.conn.execute(sql, params).fetchall())
+
+    async def publish(self, room_code):
+        await self._run("INSERT INTO round_signals (room_code, created) VALUES (?, ?)", (room_code, time.time()))
+
+    async def start(self):
+        rows = await self._run("SELECT COALESCE(MAX(id), 0) FROM round_signals")
+        self.last_id = rows[0][0]
+        self.listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                rows = await self._run("SELECT id, room_code FROM round_signals WHERE id > ? ORDER BY id", (self.last_id,))
+                for signal_id, room_code in rows:
+                    self.last_id = signal_id
+                    self._set_local(room_code)
+                await self._run("DELETE FROM round_signals WHERE created < ?", (time.time() - self.ttl,))
+            except sqlite3.Error:
+                logger.exception("Не удалось прочитать сигналы раундов")
+
+    async def close(self):
+        if self.listener:
+            self.listener.cancel()
+        self.conn.close()
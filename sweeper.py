@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, or_, select
+
+from database import Card, Player, Room, RoundAnswer
+
+logger = logging.getLogger(__name__)
+
+
+class RoomSweeper:
+    # Удаляет комнаты, в которых ничего не происходило дольше ttl секунд, вместе с игроками,
+    # своими карточками и ответами. Удаление идёт пачками по batch_size комнат, чтобы не держать
+    # долгую транзакцию; после каждой пачки on_swept(коды, user_id игроков) чистит состояние в памяти.
+    def __init__(self, session_factory, ttl, batch_size=100, on_swept=None):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.on_swept = on_swept
+
+    async def _sweep_batch(self, cutoff):
+        stale = or_(Room.last_activity < cutoff, Room.last_activity == None)
+        async with self.session_factory() as session:
+            # skip_locked: несколько воркеров не разбирают одни и те же комнаты
+            codes = (await session.execute(
+                select(Room.code).where(stale).order_by(Room.last_activity).limit(self.batch_size)
+                .with_for_update(skip_locked=True))).scalars().all()
+            if not codes:
+                return [], [], Counter()
+
+            user_ids = (await session.execute(
+                select(Player.user_id).where(Player.room_code.in_(codes)))).scalars().all()
+
+            reclaimed = Counter()
+            reclaimed["answers"] = (await session.execute(
+                delete(RoundAnswer).where(RoundAnswer.room_code.in_(codes)))).rowcount
+            reclaimed["cards"] = (await session.execute(delete(Card).where(Card.room_code.in_(codes)))).rowcount
+            reclaimed["players"] = (await session.execute(
+                delete(Player).where(Player.room_code.in_(codes)))).rowcount
+            reclaimed["rooms"] = (await session.execute(delete(Room).where(Room.code.in_(codes)))).rowcount
+            await session.commit()
+        return codes, user_ids, reclaimed
+
+    async def sweep(self):
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        total = Counter()
+        while True:
+            codes, user_ids, reclaimed = await self._sweep_batch(cutoff)
+            if codes and self.on_swept:
+                await self.on_swept(codes, user_ids)
+            total.update(reclaimed)
+            if len(codes) < self.batch_size:
+                break
+            await asyncio.sleep(0)
+
+        if total["rooms"]:
+            logger.info("Сборщик комнат: удалено комнат %d, игроков %d, карточек %d, ответов %d",
+                        total["rooms"], total["players"], total["cards"], total["answers"])
+        return total
+
+    async def run(self, interval):
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Ошибка сборщика брошенных комнат")
+            await asyncio.sleep(interval)
@@ -0,0 +1,45 @@
+import random
+
+from leaderboard import Leaderboard, ScoreIndex
+
+
+def test_score_index_matches_sorted_list():
+    rng = random.Random(1)
+    index, scores = ScoreIndex(size=4), []
+    for _ in range(2000):
+        if scores and rng.random() < 0.3:
+            index.remove(scores.pop(rng.randrange(len(scores))))
+        else:
+            # Разброс шире начального диапазона и в минус: дерево должно расти в обе стороны
+            score = rng.randint(-150, 300)
+            index.add(score)
+            scores.append(score)
+        ordered = sorted(scores, reverse=True)
+        probe = rng.randint(-200, 350)
+        assert index.above(probe) == sum(s > probe for s in scores)
+        if ordered:
+            k = rng.randint(1, len(ordered))
+            assert index.kth_from_top(k) == ordered[k - 1]
+
+
+def test_leaderboard_place_and_top_match_brute_force():
+    rng = random.Random(2)
+    board, entries = Leaderboard(), {}
+    for _ in range(1500):
+        user_id = rng.randint(1, 40)
+        delta = rng.randint(-10, 25)
+        name = rng.choice(["anna", "boris", "", None])
+        board.apply(user_id, name, delta, 1)
+        score, games, old_name = entries.get(user_id, (0, 0, name))
+        entries[user_id] = (score + delta, games + 1, name or old_name)
+
+        assert len(board) == len(entries)
+        for uid, (score, games, _) in entries.items():
+            place = 1 + sum(other[0] > score for other in entries.values())
+            assert board.place(uid) == (place, score, games)
+        k = rng.randint(1, 15)
+        expected = sorted(entries, key=lambda uid: (-entries[uid][0], entries[uid][2] or "", uid))[:k]
+        top = board.top(k)
+        assert [row[1] for row in top] == expected
+        assert all(row[0] == board.place(row[1])[0] for row in top)
+    assert board.place(999) is None
@@ -0,0 +1,45 @@
+from matching import FUZZY, NORMALIZED, STEMMED, canonical_answers, cluster, normalize, parse_strictness, stem
+
+
+def fuzzy_groups(*answers):
+    return cluster([stem(normalize(a)) for a in answers])
+
+
+def same_group(a, b):
+    groups = fuzzy_groups(a, b)
+    return groups[stem(normalize(a))] == groups[stem(normalize(b))]
+
+
+def test_different_words_one_letter_apart_do_not_match():
+    for a, b in [("корова", "корона"), ("пирог", "порог"), ("машина", "малина"), ("коронка", "воронка")]:
+        assert not same_group(a, b), (a, b)
+
+
+def test_typos_in_long_words_match():
+    for a, b in [("кастрюля", "кострюля"), ("мотоцикл", "мотоцыкл"), ("телевизор", "телевизр"),
+                 ("холодильник", "халадильник")]:
+        assert same_group(a, b), (a, b)
+
+
+def test_groups_do_not_chain():
+    groups = fuzzy_groups("корова", "корона", "коронка", "воронка", "воронки")
+    assert len(set(groups.values())) == 4
+    assert groups[stem("воронка")] == groups[stem("воронки")]
+
+
+def test_most_common_spelling_represents_group():
+    answers = {1: ["кострюля"], 2: ["кастрюля"], 3: ["кастрюля"]}
+    canonical = canonical_answers(answers, FUZZY)
+    assert canonical[1] == canonical[2] == canonical[3] == [stem("кастрюля")]
+
+
+def test_fuzzy_is_opt_in():
+    assert parse_strictness("") == {"sync": STEMMED, "diff": STEMMED, "express": STEMMED}
+    assert parse_strictness("sync=fuzzy,diff=normalized") == {"sync": FUZZY, "diff": NORMALIZED,
+                                                              "express": STEMMED}
+
+
+def test_long_answers_are_compared_exactly():
+    long_answer = "очень длинный ответ " * 30
+    typo = long_answer[:100] + "ы" + long_answer[101:]
+    assert not same_group(long_answer, typo)
@@ -0,0 +1,62 @@
+import random
+
+import room_codes
+from room_codes import ALPHABET, CodeSpace, RoomCodeAllocator, decode, encode
+
+
+def test_encode_decode_roundtrip():
+    for number in (0, 1, 35, 36, len(ALPHABET) ** 4 - 1):
+        code = encode(number, 4)
+        assert len(code) == 4 and decode(code) == number
+
+
+def test_code_space_hands_out_every_code_once():
+    # Маленькое пространство, чтобы дойти и до линейного поиска после неудачных проб
+    random.seed(1)
+    space = CodeSpace(2)
+    taken = {space.take() for _ in range(space.size)}
+    assert taken == set(range(space.size))
+    assert space.used == space.size and space.take() is None
+    space.clear(5)
+    assert space.take() == 5
+
+
+def test_allocator_codes_are_unique_and_grow_longer(monkeypatch):
+    random.seed(2)
+    clock = [0.0]
+    monkeypatch.setattr(room_codes.time, "monotonic", lambda: clock[0])
+    allocator = RoomCodeAllocator(min_length=2, max_length=3, threshold=0.5, cooldown=10)
+    allocator.mark_used("AA")
+    active, released = {"AA"}, {}
+    for _ in range(2000):
+        if active and random.random() < 0.2:
+            code = random.choice(sorted(active))
+            active.discard(code)
+            released[code] = clock[0]
+            allocator.release(code)
+        else:
+            code = allocator.allocate()
+            assert code not in active
+            assert clock[0] - released.get(code, -100) >= 10
+            active.add(code)
+        clock[0] += 0.1
+    short = [code for code in active if len(code) == 2]
+    assert len(short) <= len(ALPHABET) ** 2 * 0.5 + 1
+    assert any(len(code) == 3 for code in active)
+
+
+def test_released_code_waits_for_cooldown(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(room_codes.time, "monotonic", lambda: clock[0])
+    allocator = RoomCodeAllocator(min_length=1, max_length=1, threshold=1, cooldown=10)
+    codes = {allocator.allocate() for _ in range(len(ALPHABET))}
+    assert len(codes) == len(ALPHABET)
+    allocator.release("Q")
+    clock[0] = 5
+    try:
+        allocator.allocate()
+        assert False, "код выдан до окончания cooldown"
+    except RuntimeError:
+        pass
+    clock[0] = 10
+    assert allocator.allocate() == "Q"
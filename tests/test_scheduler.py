@@ -0,0 +1,42 @@
+import random
+
+from scheduler import CLOSE, RoundScheduler
+
+
+def test_due_events_come_out_in_deadline_order():
+    rng = random.Random(1)
+    scheduler = RoundScheduler(on_warning=None, on_close=None, warning_before=5)
+    rounds = {}
+    for round_number in range(500):
+        room_code = f"R{rng.randrange(60)}"
+        rounds[room_code] = round_number
+        # Дедлайны в будущем, чтобы в куче были и предупреждения
+        scheduler.schedule(room_code, round_number, rng.uniform(2e9, 2e9 + 1000))
+        if rng.random() < 0.1:
+            scheduler.cancel(room_code)
+            del rounds[room_code]
+
+    # Ожидаемые события — только последнего раунда каждой неотменённой комнаты
+    deadlines = {}
+    for when, _, kind, room_code, round_number in scheduler.heap:
+        if rounds.get(room_code) == round_number:
+            deadlines[(kind, room_code, round_number)] = when
+
+    fired, now = [], 2e9
+    while now < 2e9 + 1100:
+        now += rng.uniform(0, 50)
+        due = scheduler._pop_due(now)
+        assert all(deadlines[event] <= now for event in due)
+        fired.extend(due)
+    assert sorted(fired) == sorted(deadlines)
+    assert [deadlines[event] for event in fired] == sorted(deadlines[event] for event in fired)
+    assert not scheduler.rounds
+
+
+def test_close_now_fires_once_and_skips_warning():
+    scheduler = RoundScheduler(on_warning=None, on_close=None, warning_before=5)
+    scheduler.schedule("ABCD", 1, 2e9)
+    scheduler.close_now("ABCD")
+    assert scheduler._pop_due(scheduler.heap[0][0]) == [(CLOSE, "ABCD", 1)]
+    assert scheduler._pop_due(3e9) == []
+    assert not scheduler.heap and not scheduler.rounds
@@ -0,0 +1,56 @@
+import random
+
+from scoring import ANSWERS_PER_ROUND, score_round
+
+WORDS = ["кот", "пёс", "дом", "лес", "сад", "мяч", "сыр", "чай"]
+
+
+def reference_scores(r_type, answers_map):
+    # Прежний подсчёт O(P²·A): каждый ответ сравнивается с ответами всех остальных игроков
+    scores = {}
+    for player_id, answers in answers_map.items():
+        hits = 0
+        for i, answer in enumerate(answers):
+            found = False
+            for other_id, other in answers_map.items():
+                if other_id == player_id:
+                    continue
+                if r_type == "express":
+                    found = i < len(other) and other[i] == answer
+                else:
+                    found = answer in other
+                if found:
+                    break
+            if found == (r_type != "diff"):
+                hits += 1
+        if len(answers) == ANSWERS_PER_ROUND and hits == ANSWERS_PER_ROUND:
+            hits += 1
+        scores[player_id] = hits
+    return scores
+
+
+def random_round(rng):
+    # Маленький словарь, чтобы совпадения и повторы внутри одного набора были частыми
+    words = WORDS[:rng.randint(1, len(WORDS))]
+    return {player_id: [rng.choice(words) for _ in range(rng.randint(0, ANSWERS_PER_ROUND))]
+            for player_id in range(rng.randint(1, 8))}
+
+
+def test_score_round_matches_pairwise_loop():
+    rng = random.Random(1)
+    for _ in range(3000):
+        answers_map = random_round(rng)
+        for r_type in ("sync", "diff", "express"):
+            assert score_round(r_type, answers_map) == reference_scores(r_type, answers_map), (r_type, answers_map)
+
+
+def test_full_set_bonus():
+    same = ["кот", "пёс", "дом", "лес", "сад", "мяч"]
+    assert score_round("sync", {1: same, 2: list(same)}) == {1: 7, 2: 7}
+    assert score_round("express", {1: same, 2: same[::-1]}) == {1: 0, 2: 0}
+    assert score_round("diff", {1: same, 2: ["сыр"]}) == {1: 7, 2: 1}
+
+
+def test_repeated_answer_is_not_a_match_with_itself():
+    assert score_round("sync", {1: ["кот", "кот"], 2: ["пёс"]}) == {1: 0, 2: 0}
+    assert score_round("diff", {1: ["кот", "кот"], 2: ["пёс"]}) == {1: 2, 2: 1}
@@ -0,0 +1,38 @@
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from database import async_session
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    # Одна сессия на апдейт, передаётся хендлеру как session. Соединение берётся из пула только
+    # при первом запросе; в конце — один commit, при исключении сессия закрывается с откатом.
+    # Хендлер может закоммитить раньше, чтобы вернуть соединение в пул перед отправкой сообщений.
+    def __init__(self, session_factory=async_session):
+        self.session_factory = session_factory
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with self.session_factory() as session:
+            data["session"] = session
+            result = await handler(event, data)
+            if session.in_transaction():
+                await session.commit()
+            return result
+
+
+@asynccontextmanager
+async def session_scope(session=None):
+    # Своя сессия для фоновых задач или уже открытая сессия вызывающего
+    if session is not None:
+        yield session
+        return
+    async with async_session() as session:
+        yield session
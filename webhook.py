@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import json
+import logging
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import ClientSession, web
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    # Telegram получает ответ сразу, апдейт обрабатывается в фоне.
+    # Когда в работе max_in_flight апдейтов, новые запросы ждут свободного места — это и есть backpressure.
+    def __init__(self, dp: Dispatcher, bot: Bot, path, secret=None, max_in_flight=100):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.tasks = set()
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request):
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError:
+            return web.Response(status=400)
+
+        await self.semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.Response()
+
+    async def _process(self, update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logger.exception("Ошибка при обработке апдейта %s", update.update_id)
+        finally:
+            self.semaphore.release()
+
+    async def drain(self):
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host, port, path, secret=None, public_url=None, max_in_flight=100):
+    server = WebhookServer(dp, bot, path, secret=secret, max_in_flight=max_in_flight)
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    # Без публичного адреса сервер работает локально: апдейты можно присылать через `python webhook.py replay`
+    if public_url:
+        await bot.set_webhook(public_url.rstrip("/") + path, secret_token=secret, max_connections=max_in_flight,
+                              allowed_updates=dp.resolve_used_update_types())
+    logger.info("Webhook слушает %s:%s%s", host, port, path)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await server.drain()
+
+
+async def replay_updates(url, path, secret=None):
+    headers = {SECRET_HEADER: secret} if secret else {}
+    async with ClientSession() as session:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                async with session.post(url, json=json.loads(line), headers=headers) as response:
+                    print(response.status, line.strip()[:80])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отправка записанных апдейтов (NDJSON) на локальный webhook")
+    parser.add_argument("command", choices=["replay"])
+    parser.add_argument("updates", help="файл с апдейтами, по одному JSON в строке")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret")
+    args = parser.parse_args()
+    asyncio.run(replay_updates(args.url, args.updates, args.secret))